@@ -0,0 +1,122 @@
+#!/usr/bin/python
+import click
+import logging
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from data_utils import ELEMENT_TYPES, iter_annotation_bboxes
+from split_reader import FigureQASplit
+
+
+BBOX_COLUMNS_FILE = "bboxes.npz"
+
+# Boxes are collected in preallocated arrays of this many rows
+CHUNK_ROWS = 64 * 1024
+
+
+def export_bbox_columns(split_directory, output_file_npz=None):
+    """
+    Writes every bounding box of a combined split as one float32 (N, 4) array of x, y, w, h, with integer
+    columns for the image index, element type (an index into ELEMENT_TYPES), model index, and item index
+    of each box. The boxes of image i are rows image_offsets[i] to image_offsets[i + 1].
+    """
+    output_file_npz = output_file_npz if output_file_npz else os.path.join(split_directory, BBOX_COLUMNS_FILE)
+    split = FigureQASplit(split_directory)
+
+    element_ids = dict((element, i) for i, element in enumerate(ELEMENT_TYPES))
+    counts = np.zeros(len(split), dtype=np.int64)
+
+    # Python tuples of every box would take several times the memory of the arrays
+    bbox_chunks, row_chunks = [], []
+    bboxes, rows, n = None, None, CHUNK_ROWS
+
+    for annotations in tqdm(split.iter_annotations(), total=len(split), desc="Reading annotations"):
+        image_index = annotations['image_index']
+
+        for element, model_index, item_index, bbox in iter_annotation_bboxes(annotations):
+            if n == CHUNK_ROWS:
+                bboxes = np.empty((CHUNK_ROWS, 4), dtype=np.float32)
+                rows = np.empty((CHUNK_ROWS, 4), dtype=np.int32)
+                n = 0
+                bbox_chunks.append(bboxes)
+                row_chunks.append(rows)
+
+            bboxes[n] = (bbox['x'], bbox['y'], bbox['w'], bbox['h'])
+            rows[n] = (image_index, element_ids[element], model_index, item_index)
+            n += 1
+            counts[image_index] += 1
+
+    if bbox_chunks:
+        bbox_chunks[-1], row_chunks[-1] = bboxes[:n], rows[:n]
+
+    bboxes = np.concatenate(bbox_chunks) if bbox_chunks else np.zeros((0, 4), dtype=np.float32)
+    rows = np.concatenate(row_chunks) if row_chunks else np.zeros((0, 4), dtype=np.int32)
+
+    # Annotations are in image index order, so the rows of each image are already contiguous
+    image_offsets = np.zeros(len(split) + 1, dtype=np.int64)
+    np.cumsum(counts, out=image_offsets[1:])
+
+    np.savez(output_file_npz,
+             bboxes=bboxes,
+             image_index=rows[:, 0].astype(np.int32),
+             element=rows[:, 1].astype(np.int8),
+             model_index=rows[:, 2].astype(np.int16),
+             item_index=rows[:, 3].astype(np.int32),
+             image_offsets=image_offsets,
+             element_types=np.array(ELEMENT_TYPES))
+
+
+class BBoxColumns (object):
+    """
+    Reads the boxes written by 'export_bbox_columns'. Lookups by image index return array views; the
+    dicts of the JSON annotations are only built on request, by 'bbox_dicts'.
+    """
+
+    def __init__(self, bbox_columns_npz):
+        with np.load(bbox_columns_npz) as stored:
+            self.columns = dict((key, stored[key]) for key in stored.files)
+
+        self.element_types = [str(element) for element in self.columns['element_types']]
+        self.image_offsets = self.columns['image_offsets']
+
+    def __len__(self):
+        return len(self.image_offsets) - 1
+
+    def _rows(self, image_index):
+        return slice(self.image_offsets[image_index], self.image_offsets[image_index + 1])
+
+    def bboxes(self, image_index, element=None):
+        """ Returns the (n, 4) boxes of an image, optionally only those of one element type. """
+        rows = self._rows(image_index)
+        bboxes = self.columns['bboxes'][rows]
+
+        if element is not None:
+            bboxes = bboxes[self.columns['element'][rows] == self.element_types.index(element)]
+
+        return bboxes
+
+    def column(self, name, image_index):
+        return self.columns[name][self._rows(image_index)]
+
+    def bbox_dicts(self, image_index, element=None):
+        """ Returns the boxes of 'bboxes' as dicts, like the 'bbox' entries of the JSON annotations. """
+        return [{'x': float(x), 'y': float(y), 'w': float(w), 'h': float(h)}
+                for x, y, w, h in self.bboxes(image_index, element)]
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--output-file-npz", default=None,
+                help="where to write the boxes, defaults to %s in SPLIT_DIRECTORY" % BBOX_COLUMNS_FILE)
+def main(**kwargs):
+    """
+    Exports the bounding boxes in the annotations of SPLIT_DIRECTORY, produced by 'json_combiner.py', as NumPy arrays.
+    """
+    logging.basicConfig(level=logging.INFO)
+    export_bbox_columns(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+from __future__ import division
+
+import click
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from collections import defaultdict
+
+import numpy as np
+
+import source_data_generation
+
+from data_utils import build_source_annotations, combine_source_and_rendered_data, merge_rendered_data, FIGURE_TYPES
+from json_combiner import combine_figure_data
+from mock_rendering import mock_rendered_data
+from questions.categorical import generate_bar_graph_questions, generate_pie_chart_questions
+from questions.lines import generate_line_plot_questions
+from questions.utils import NUM_DISTINCT_QS
+
+
+STAGES = ["source", "questions", "annotations", "figures", "combine"]
+
+QUESTION_GENERATORS = {
+    'vbar_categorical': generate_bar_graph_questions,
+    'hbar_categorical': generate_bar_graph_questions,
+    'pie': generate_pie_chart_questions,
+    'line': generate_line_plot_questions,
+    'dot_line': generate_line_plot_questions
+}
+
+
+def benchmark_annotation_assembly(source_data_json, repeat=20):
+    """
+    Times building the annotations of every figure in SOURCE_DATA_JSON, with synthetic rendered data
+    from 'mock_rendering.py'. Returns the mean microseconds per figure of the source-only pass, the
+    rendered data merge, and both, by figure type.
+    """
+    with open(source_data_json, 'r') as f:
+        figures = json.load(f)['data']
+
+    rendered = [mock_rendered_data(source) for source in figures]
+
+    totals = defaultdict(lambda: [0.0, 0.0])
+    counts = defaultdict(int)
+    timer = timeit.default_timer
+
+    for _ in range(repeat):
+        for source, rendered_data in zip(figures, rendered):
+            start = timer()
+            annotations = build_source_annotations(source)
+            built = timer()
+            merge_rendered_data(annotations, rendered_data)
+            merged = timer()
+
+            totals[source['type']][0] += built - start
+            totals[source['type']][1] += merged - built
+            counts[source['type']] += 1
+
+    results = {}
+    for fig_type in totals:
+        source_us, merge_us = [1e6 * t / counts[fig_type] for t in totals[fig_type]]
+        results[fig_type] = {'source_us': source_us, 'merge_us': merge_us, 'total_us': source_us + merge_us}
+
+    return results
+
+
+def _seed(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def _best_time(run, repeat, setup=None):
+    """ Returns the fastest of REPEAT runs, as the least disturbed by the rest of the machine. """
+    best = None
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = timeit.default_timer()
+        run()
+        elapsed = timeit.default_timer() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def _benchmark_figure_type(fig_type, n_figures, stages, seed, repeat, work_dir):
+    """ Returns the seconds each of STAGES takes on N_FIGURES figures of FIG_TYPE. """
+    seconds = {}
+    generate = getattr(source_data_generation, "generate_" + fig_type)
+    color_map = source_data_generation.color_map
+
+    # Later stages run on the figures of the source stage, whether it is timed or not
+    figures = []
+
+    def run_source():
+        del figures[:]
+        figures.extend([generate() for _ in range(n_figures)])
+
+    seconds['source'] = _best_time(run_source, repeat if 'source' in stages else 1, lambda: _seed(seed))
+
+    if 'questions' in stages:
+        generate_questions = QUESTION_GENERATORS[fig_type]
+        seconds['questions'] = _best_time(
+            lambda: [generate_questions(combine_source_and_rendered_data(source), color_map=color_map) for source in figures],
+            repeat, lambda: _seed(seed))
+
+    if 'annotations' in stages:
+        rendered = [mock_rendered_data(source) for source in figures]
+        seconds['annotations'] = _best_time(
+            lambda: [merge_rendered_data(build_source_annotations(source), rendered_data)
+                     for source, rendered_data in zip(figures, rendered)],
+            repeat)
+
+    figure_dir = os.path.join(work_dir, "figures")
+    combined_dir = os.path.join(work_dir, "combined")
+
+    if 'figures' in stages or 'combine' in stages:
+        # Imported here as it needs Bokeh and Selenium, although no browser is started
+        from figure_generation import generate_figures
+
+        source_data_json = os.path.join(work_dir, "source_data.json")
+        with open(source_data_json, 'w') as f:
+            json.dump({'data': figures, 'total_distinct_questions': NUM_DISTINCT_QS,
+                       'total_distinct_colors': len(color_map)}, f)
+
+        seconds['figures'] = _best_time(lambda: generate_figures(source_data_json, figure_dir, render_backend="mock"),
+                                        repeat if 'figures' in stages else 1,
+                                        lambda: shutil.rmtree(figure_dir, ignore_errors=True))
+
+    if 'combine' in stages:
+        seconds['combine'] = _best_time(lambda: combine_figure_data(combined_dir, [figure_dir]), repeat,
+                                        lambda: shutil.rmtree(combined_dir, ignore_errors=True))
+
+    return dict((stage, seconds[stage]) for stage in stages)
+
+
+def run_benchmark_suite(
+        data_config_yaml=os.path.join("config", "color_scheme1_source_data.yaml"),
+        common_config_yaml=os.path.join("config", "common_source_data.yaml"),
+        colors=os.path.join("resources", "x11_colors_refined.txt"),
+        figure_types=None,
+        sizes=(10, 100),
+        stages=None,
+        seed=1,
+        repeat=3
+    ):
+    """
+    Measures the figures per second of each stage of the pipeline for each figure type and number of
+    figures in SIZES, offline and with fixed seeds. Rendering uses the mock backend, so the 'figures'
+    stage is everything of 'figure_generation.py' but the browser.
+    """
+    figure_types = figure_types if figure_types else FIGURE_TYPES
+    stages = stages if stages else STAGES
+
+    source_data_generation.load_generation_config(data_config_yaml, common_config_yaml, colors)
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="figureqa_benchmark_")
+
+    try:
+        for fig_type in figure_types:
+            for n_figures in sizes:
+                seconds = _benchmark_figure_type(fig_type, n_figures, stages, seed, repeat, work_dir)
+
+                for stage in stages:
+                    results.append({
+                        'stage': stage,
+                        'figure_type': fig_type,
+                        'n_figures': n_figures,
+                        'seconds': seconds[stage],
+                        'figures_per_second': n_figures / seconds[stage]
+                    })
+
+                logging.info("%s x %d: %s" % (fig_type, n_figures,
+                             ", ".join("%s %.1f fig/s" % (stage, n_figures / seconds[stage]) for stage in stages)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': multiprocessing.cpu_count()
+        },
+        'data_config_yaml': data_config_yaml,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def _result_key(result):
+    return (result['stage'], result['figure_type'], result['n_figures'])
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Returns (comparisons, regressions): each result that is also in BASELINE as (stage, figure type,
+    number of figures, baseline figures per second, figures per second, relative change), and those of
+    them that are more than THRESHOLD slower.
+    """
+    baseline_fps = dict((_result_key(r), r['figures_per_second']) for r in baseline['results'])
+
+    comparisons = []
+    for result in results['results']:
+        key = _result_key(result)
+
+        if key in baseline_fps:
+            change = result['figures_per_second'] / baseline_fps[key] - 1
+            comparisons.append(key + (baseline_fps[key], result['figures_per_second'], change))
+
+    regressions = [c for c in comparisons if c[-1] < -threshold]
+    return comparisons, regressions
+
+
+@click.group()
+def main():
+    """ Benchmarks of the generation pipeline that run without a browser. """
+    logging.basicConfig(level=logging.INFO)
+
+
+@main.command()
+@click.argument("source_data_json")
+@click.option("-r", "--repeat", default=20, type=int,
+                help="number of times each figure is assembled")
+def annotations(source_data_json, repeat):
+    """
+    Micro-benchmarks the per-figure annotation assembly of 'data_utils.py' on SOURCE_DATA_JSON, produced
+    by 'source_data_generation.py'.
+    """
+    results = benchmark_annotation_assembly(source_data_json, repeat)
+
+    print("%-18s %12s %12s %12s" % ("figure type", "source (us)", "merge (us)", "total (us)"))
+    for fig_type in FIGURE_TYPES:
+        if fig_type in results:
+            r = results[fig_type]
+            print("%-18s %12.1f %12.1f %12.1f" % (fig_type, r['source_us'], r['merge_us'], r['total_us']))
+
+
+@main.command()
+@click.option("--data-config-yaml", default=os.path.join("config", "color_scheme1_source_data.yaml"),
+                help="plotting parameters to generate the figures with")
+@click.option("-c", "--common-config-yaml", default=os.path.join("config", "common_source_data.yaml"),
+                help="YAML file with common plotting and style attributes")
+@click.option("--colors", default=os.path.join("resources", "x11_colors_refined.txt"),
+                help="file with all color names and hexcodes")
+@click.option("-t", "--figure-type", "figure_types", multiple=True, type=click.Choice(FIGURE_TYPES),
+                help="figure type to benchmark, can be repeated. Defaults to all")
+@click.option("-n", "--sizes", default="10,100",
+                help="comma-separated numbers of figures to run each stage on")
+@click.option("-s", "--stage", "stages", multiple=True, type=click.Choice(STAGES),
+                help="stage to benchmark, can be repeated. Defaults to all")
+@click.option("--seed", default=1, type=int,
+                help="seed for PRNGs")
+@click.option("-r", "--repeat", default=3, type=int,
+                help="number of runs of each measurement, of which the fastest counts")
+@click.option("-o", "--output-json", default=None,
+                help="file to save the results to, e.g. to use as a baseline later")
+@click.option("-b", "--baseline-json", default=None,
+                help="results of an earlier run to compare to")
+@click.option("--threshold", default=0.2, type=float,
+                help="fail if a stage is slower than in the baseline by more than this fraction")
+def suite(data_config_yaml, common_config_yaml, colors, figure_types, sizes, stages, seed, repeat, output_json,
+          baseline_json, threshold):
+    """
+    Measures figures per second of each pipeline stage by figure type and number of figures, and
+    optionally compares them to a baseline, exiting with an error on a regression.
+    """
+    results = run_benchmark_suite(data_config_yaml, common_config_yaml, colors, list(figure_types),
+                                  [int(n) for n in sizes.split(",")], list(stages), seed, repeat)
+
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if not baseline_json:
+        return
+
+    with open(baseline_json, 'r') as f:
+        baseline = json.load(f)
+
+    comparisons, regressions = compare_to_baseline(results, baseline, threshold)
+
+    print("%-12s %-18s %8s %14s %14s %9s" % ("stage", "figure type", "figures", "baseline fig/s", "fig/s", "change"))
+    for stage, fig_type, n_figures, baseline_fps, fps, change in comparisons:
+        print("%-12s %-18s %8d %14.1f %14.1f %+8.1f%%" % (stage, fig_type, n_figures, baseline_fps, fps, 100 * change))
+
+    if regressions:
+        logging.error("%d of %d measurements regressed by more than %d%%" % (
+            len(regressions), len(comparisons), 100 * threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+import click
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from tqdm import tqdm
+
+from data_utils import ELEMENT_TYPES, iter_annotation_bboxes
+from json_streaming import JSONArrayWriter
+from split_reader import FigureQASplit
+
+
+COCO_FILE = "coco_annotations.json"
+
+DATA_ELEMENT_TYPES = ["bar", "wedge", "pie_label", "line_segment", "line_point"]
+
+
+def _supercategory(element):
+    if element in DATA_ELEMENT_TYPES:
+        return "data"
+    elif element.startswith("legend"):
+        return "legend"
+    elif element.startswith("x_") or element.startswith("y_"):
+        return element[:1] + "_axis"
+    else:
+        return "figure"
+
+
+def get_coco_categories():
+    """ Returns the COCO categories of all ELEMENT_TYPES; a category's id is 1 + its index there. """
+    return [{'id': i + 1, 'name': element, 'supercategory': _supercategory(element)}
+            for i, element in enumerate(ELEMENT_TYPES)]
+
+
+def _init_worker(split_directory, index, elements):
+    global worker_split
+    global worker_category_ids
+    worker_split = FigureQASplit(split_directory, cache_size=1, index=index)
+    worker_category_ids = dict((element, ELEMENT_TYPES.index(element) + 1) for element in elements)
+
+
+def _convert_figures(image_indices):
+    """
+    Returns the COCO image entry and the annotations of each figure, serialized. Annotations are
+    missing their leading id, which is only known once all previous figures are written.
+    """
+    converted = []
+
+    for image_index in image_indices:
+        annotations = worker_split.annotations(image_index)
+        figure_bbox = annotations['general_figure_info']['figure_info']['bbox']['bbox']
+
+        image = json.dumps({'id': image_index, 'file_name': "%d.png" % image_index,
+                            'width': figure_bbox['w'], 'height': figure_bbox['h'],
+                            'figure_type': annotations['type']})
+
+        coco_annotations = []
+        for element, model_index, item_index, bbox in iter_annotation_bboxes(annotations):
+            if element not in worker_category_ids:
+                continue
+
+            coco_annotations.append(json.dumps({
+                'image_id': image_index,
+                'category_id': worker_category_ids[element],
+                'bbox': [bbox['x'], bbox['y'], bbox['w'], bbox['h']],
+                'area': bbox['w'] * bbox['h'],
+                'iscrowd': 0,
+                'model_index': model_index,
+                'item_index': item_index
+            })[1:])
+
+        converted.append((image, coco_annotations))
+
+    return converted
+
+
+def export_coco(split_directory, output_file_json=None, elements=None, n_workers=None, chunk_size=256):
+    """
+    Writes the bounding boxes of a combined split as COCO-style detection annotations, with one category
+    per element type of ELEMENT_TYPES (optionally only ELEMENTS). Figures are converted in chunks of
+    CHUNK_SIZE on a process pool and streamed to the file in order, so memory use doesn't grow with the split.
+    """
+    output_file_json = output_file_json if output_file_json else os.path.join(split_directory, COCO_FILE)
+    elements = elements if elements else ELEMENT_TYPES
+
+    split = FigureQASplit(split_directory)
+    image_indices = [int(i) for i in split.image_indices]
+    chunks = [image_indices[i:i + chunk_size] for i in range(0, len(image_indices), chunk_size)]
+
+    info = {'description': "FigureQA", 'split_directory': os.path.abspath(split_directory)}
+    categories = [category for category in get_coco_categories() if category['name'] in elements]
+    head = '{"info": %s, "categories": %s, "images": ' % (json.dumps(info), json.dumps(categories))
+
+    n_workers = n_workers if n_workers else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(split_directory, split.index, elements))
+
+    # Annotations are spooled to a temporary file until the images array is complete
+    annotations_f = tempfile.TemporaryFile(mode='w+', dir=os.path.dirname(os.path.abspath(output_file_json)))
+
+    try:
+        with open(output_file_json, 'w') as f:
+            images_writer = JSONArrayWriter(f, head)
+            annotations_writer = JSONArrayWriter(annotations_f)
+
+            # Bounded number of chunks in flight
+            window = 4 * n_workers
+            progress = tqdm(total=len(image_indices), desc="Exporting COCO annotations")
+
+            for i in range(0, len(chunks), window):
+                for converted in pool.imap(_convert_figures, chunks[i:i + window]):
+                    for image, coco_annotations in converted:
+                        images_writer.write_json(image)
+
+                        for coco_annotation in coco_annotations:
+                            annotations_writer.write_json('{"id": %d, %s' % (annotations_writer.count + 1, coco_annotation))
+
+                    progress.update(len(converted))
+
+            progress.close()
+
+            images_writer.close(', "annotations": ')
+            annotations_writer.close()
+
+            annotations_f.seek(0)
+            shutil.copyfileobj(annotations_f, f)
+            f.write("}")
+
+    finally:
+        annotations_f.close()
+        pool.close()
+        pool.join()
+
+    logging.info("Wrote %d images and %d annotations" % (images_writer.count, annotations_writer.count))
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--output-file-json", default=None,
+                help="where to write the annotations, defaults to %s in SPLIT_DIRECTORY" % COCO_FILE)
+@click.option("-e", "--element", "elements", multiple=True, type=click.Choice(ELEMENT_TYPES),
+                help="export only boxes of this element type, can be repeated")
+@click.option("-w", "--n-workers", default=None, type=int,
+                help="number of converting processes, defaults to the number of CPUs")
+def main(split_directory, output_file_json, elements, n_workers):
+    """
+    Exports the bounding boxes of SPLIT_DIRECTORY, produced by 'json_combiner.py', as COCO-style
+    detection annotations. Image file names are relative to the png/ directory of the split.
+    """
+    logging.basicConfig(level=logging.INFO)
+    export_coco(split_directory, output_file_json, list(elements), n_workers)
+
+
+if __name__ == "__main__":
+    main()
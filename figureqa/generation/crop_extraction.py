@@ -0,0 +1,184 @@
+#!/usr/bin/python
+import click
+import logging
+import math
+import multiprocessing
+import os
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from data_utils import ELEMENT_TYPES, iter_annotation_bboxes
+from split_reader import FigureQASplit
+
+
+CROPS_FILE = "crops.uint8"
+CROPS_INDEX_FILE = "crops_index.npz"
+
+DEFAULT_CROP_ELEMENTS = ["bar", "wedge", "legend_label", "legend_preview"]
+
+
+def _init_worker(split_directory, index, elements):
+    global worker_split
+    global worker_elements
+    worker_split = FigureQASplit(split_directory, cache_size=1, index=index)
+    worker_elements = set(elements)
+
+
+def _crop_label(annotations, element, model_index, item_index):
+    if model_index < 0:
+        return ""
+
+    model = annotations['models'][model_index]
+
+    # Bar graphs have a single model, with the color of each bar in its labels
+    if element == "bar":
+        return model['labels'][item_index]
+
+    return model['name']
+
+
+def _crop_figures(image_indices):
+    """ Returns the metadata and pixels of every crop of the figures, decoding each image once. """
+    crops = []
+
+    for image_index in image_indices:
+        annotations = worker_split.annotations(image_index)
+        image = np.asarray(Image.open(worker_split.image_path(image_index)).convert("RGB"))
+        height, width = image.shape[:2]
+
+        for element, model_index, item_index, bbox in iter_annotation_bboxes(annotations):
+            if element not in worker_elements:
+                continue
+
+            x0, y0 = max(int(math.floor(bbox['x'])), 0), max(int(math.floor(bbox['y'])), 0)
+            x1 = min(int(math.ceil(bbox['x'] + bbox['w'])), width)
+            y1 = min(int(math.ceil(bbox['y'] + bbox['h'])), height)
+
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            label = _crop_label(annotations, element, model_index, item_index)
+            crops.append(((image_index, element, model_index, item_index, label, y1 - y0, x1 - x0),
+                          image[y0:y1, x0:x1].tobytes()))
+
+    return crops
+
+
+def extract_crops(split_directory, output_directory=None, elements=None, n_workers=None, chunk_size=64):
+    """
+    Cuts the boxes of ELEMENTS out of every image of a combined split into one packed uint8 file, with
+    a table of the offset, shape, image index, element type, model index, item index, and label of each
+    crop. A crop's label is the color name of the bar, wedge, line, or legend item it shows, or empty
+    for elements that don't belong to a plot element.
+    """
+    output_directory = output_directory if output_directory else os.path.join(split_directory, "crops")
+    elements = elements if elements else DEFAULT_CROP_ELEMENTS
+
+    if not os.path.exists(output_directory):
+        os.mkdir(output_directory)
+
+    split = FigureQASplit(split_directory)
+    image_indices = [int(i) for i in split.image_indices]
+    chunks = [image_indices[i:i + chunk_size] for i in range(0, len(image_indices), chunk_size)]
+
+    n_workers = n_workers if n_workers else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(split_directory, split.index, elements))
+
+    rows, labels, label_ids = [], [], {}
+    offset = 0
+
+    try:
+        with open(os.path.join(output_directory, CROPS_FILE), 'wb') as f:
+            progress = tqdm(total=len(image_indices), desc="Extracting crops")
+
+            # Bounded number of chunks in flight
+            window = 4 * n_workers
+            for i in range(0, len(chunks), window):
+                for chunk, crops in zip(chunks[i:i + window], pool.imap(_crop_figures, chunks[i:i + window])):
+                    for (image_index, element, model_index, item_index, label, height, width), pixels in crops:
+                        if label not in label_ids:
+                            label_ids[label] = len(labels)
+                            labels.append(label)
+
+                        f.write(pixels)
+                        rows.append((offset, height, width, image_index, ELEMENT_TYPES.index(element),
+                                     model_index, item_index, label_ids[label]))
+                        offset += len(pixels)
+
+                    progress.update(len(chunk))
+
+            progress.close()
+
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 8)
+    np.savez(os.path.join(output_directory, CROPS_INDEX_FILE),
+             offset=rows[:, 0],
+             height=rows[:, 1].astype(np.int32),
+             width=rows[:, 2].astype(np.int32),
+             image_index=rows[:, 3].astype(np.int32),
+             element=rows[:, 4].astype(np.int8),
+             model_index=rows[:, 5].astype(np.int16),
+             item_index=rows[:, 6].astype(np.int32),
+             label=rows[:, 7].astype(np.int32),
+             labels=np.array(labels),
+             element_types=np.array(ELEMENT_TYPES))
+
+    logging.info("Extracted %d crops (%d bytes) of %d images" % (len(rows), offset, len(image_indices)))
+
+
+class CropStore (object):
+    """
+    Reads crops written by 'extract_crops'. Indexing returns a crop as an (h, w, 3) uint8 array viewed
+    from the memory-mapped file, and the label table is available as integer columns.
+    """
+
+    def __init__(self, directory):
+        with np.load(os.path.join(directory, CROPS_INDEX_FILE)) as stored:
+            self.columns = dict((key, stored[key]) for key in stored.files)
+
+        self.labels = [str(label) for label in self.columns['labels']]
+        self.element_types = [str(element) for element in self.columns['element_types']]
+
+        # An empty file can't be memory-mapped
+        crops_file = os.path.join(directory, CROPS_FILE)
+        self.data = np.memmap(crops_file, dtype=np.uint8, mode='r') if os.path.getsize(crops_file) \
+            else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.columns['offset'])
+
+    def __getitem__(self, i):
+        height, width = int(self.columns['height'][i]), int(self.columns['width'][i])
+        offset = int(self.columns['offset'][i])
+        return self.data[offset:offset + height * width * 3].reshape(height, width, 3)
+
+    def label(self, i):
+        return self.labels[self.columns['label'][i]]
+
+    def element(self, i):
+        return self.element_types[self.columns['element'][i]]
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--output-directory", default=None,
+                help="where to write the crops, defaults to crops/ in SPLIT_DIRECTORY")
+@click.option("-e", "--element", "elements", multiple=True, type=click.Choice(ELEMENT_TYPES),
+                help="crop boxes of this element type, can be repeated. Defaults to %s" % ", ".join(DEFAULT_CROP_ELEMENTS))
+@click.option("-w", "--n-workers", default=None, type=int,
+                help="number of cropping processes, defaults to the number of CPUs")
+def main(split_directory, output_directory, elements, n_workers):
+    """
+    Extracts crops of the annotated elements in the images of SPLIT_DIRECTORY, produced by 'json_combiner.py'.
+    """
+    logging.basicConfig(level=logging.INFO)
+    extract_crops(split_directory, output_directory, list(elements), n_workers)
+
+
+if __name__ == "__main__":
+    main()
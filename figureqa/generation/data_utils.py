@@ -1,12 +1,16 @@
 #!/usr/bin/python
 from __future__ import division
 
-import copy
+import itertools
+import os
 import random
 
 import numpy as np
 
 
+FIGURE_TYPES = ["vbar_categorical", "hbar_categorical", "pie", "line", "dot_line"]
+
+
 # Used in modified BokehJS
 ID_MAP = {
     'title': 'the_title',
@@ -24,163 +28,264 @@ def _map_axis_data(axis_data):
 
     for key in axis_data:
         if key in ['major_ticks', 'major_labels', 'minor_ticks']:
-            final_data[key] = { 'bboxes': map(lambda x: x['bbox'], axis_data[key]),
-                                'values': map(lambda x: x['value'] if 'value' in x else x['text'], axis_data[key]) }
+            items = axis_data[key]
+            final_data[key] = { 'bboxes': [x['bbox'] for x in items],
+                                'values': [x['value'] if 'value' in x else x['text'] for x in items] }
         elif key in ['rule', 'label']:
-            final_data[key] = copy.deepcopy(axis_data[key][0])
+            final_data[key] = axis_data[key][0]
 
     return final_data
 
 
-def _get_general_figure_data(source_data=None, rendered_data=None):
+def _map_gridlines_data(gridlines_data):
+    gridlines = gridlines_data['gridlines']
+    return {'bboxes': [x['bbox'] for x in gridlines], 'values': [x['value'] for x in gridlines]}
 
-    if not rendered_data:
-        return {}
 
-    data_access_functions = {
-        'title':  lambda x: copy.deepcopy(x['title']),
-        'x_axis': _map_axis_data,
-        'y_axis': _map_axis_data,
-        'x_gridlines': lambda x: {'bboxes': map(lambda y: y['bbox'], x['gridlines']), 'values': map(lambda y: y['value'], x['gridlines'])},
-        'y_gridlines': lambda x: {'bboxes': map(lambda y: y['bbox'], x['gridlines']), 'values': map(lambda y: y['value'], x['gridlines'])},
-        'legend': lambda x: {'bbox': x['bbox'], 'items': copy.deepcopy(x['items'])},
-        'figure_info': lambda x: { 'bbox': {'bbox': {'x': 0, 'y': 0, 'w': x['w'], 'h': x['h']}}}
-    }
+# Rendered values are referenced, not copied, as the rendered data of a figure is only used for its annotations
+GENERAL_FIGURE_DATA_FUNCTIONS = {
+    'title':  lambda x: x['title'],
+    'x_axis': _map_axis_data,
+    'y_axis': _map_axis_data,
+    'x_gridlines': _map_gridlines_data,
+    'y_gridlines': _map_gridlines_data,
+    'legend': lambda x: {'bbox': x['bbox'], 'items': x['items']},
+    'figure_info': lambda x: { 'bbox': {'bbox': {'x': 0, 'y': 0, 'w': x['w'], 'h': x['h']}}}
+}
 
-    def get_plot_bbox():
 
-        # Special case for pie charts
-        if source_data and 'type' in source_data and source_data['type'] == 'pie':
-            xs = []
-            ys = []
+def _get_plot_bbox(figure_type, rendered_data):
 
-            for model_data in rendered_data.values():
-                if 'slices' not in model_data:
-                    continue
-                slice_bbox = model_data['slices'][0]['bbox'] 
-                xs.append(slice_bbox['x'])
-                xs.append(slice_bbox['x'] + slice_bbox['w'])
-                ys.append(slice_bbox['y'])
-                ys.append(slice_bbox['y'] + slice_bbox['h'])
+    # Special case for pie charts
+    if figure_type == 'pie':
+        xs = []
+        ys = []
 
-        else:
-            x_axis_bbox = rendered_data[ID_MAP['x_axis']]['rule'][0]['bbox']
-            y_axis_bbox = rendered_data[ID_MAP['y_axis']]['rule'][0]['bbox']
+        for model_data in rendered_data.values():
+            if 'slices' not in model_data:
+                continue
+            slice_bbox = model_data['slices'][0]['bbox']
+            xs.append(slice_bbox['x'])
+            xs.append(slice_bbox['x'] + slice_bbox['w'])
+            ys.append(slice_bbox['y'])
+            ys.append(slice_bbox['y'] + slice_bbox['h'])
+
+    else:
+        x_axis_bbox = rendered_data[ID_MAP['x_axis']]['rule'][0]['bbox']
+        y_axis_bbox = rendered_data[ID_MAP['y_axis']]['rule'][0]['bbox']
 
-            xs = [  x_axis_bbox['x'], x_axis_bbox['x'] + x_axis_bbox['w'],
-                    y_axis_bbox['x'], y_axis_bbox['x'] + y_axis_bbox['w'] ]
+        xs = [  x_axis_bbox['x'], x_axis_bbox['x'] + x_axis_bbox['w'],
+                y_axis_bbox['x'], y_axis_bbox['x'] + y_axis_bbox['w'] ]
 
-            ys = [  x_axis_bbox['y'], x_axis_bbox['y'] + x_axis_bbox['h'],
-                    y_axis_bbox['y'], y_axis_bbox['y'] + y_axis_bbox['h'] ]
+        ys = [  x_axis_bbox['y'], x_axis_bbox['y'] + x_axis_bbox['h'],
+                y_axis_bbox['y'], y_axis_bbox['y'] + y_axis_bbox['h'] ]
 
-        min_x = min(xs)
-        min_y = min(ys)
+    min_x = min(xs)
+    min_y = min(ys)
 
-        return {'x': min_x, 'y': min_y, 'w': max(xs) - min_x, 'h': max(ys) - min_y}
+    return {'x': min_x, 'y': min_y, 'w': max(xs) - min_x, 'h': max(ys) - min_y}
 
+
+def _get_general_figure_data(figure_type, rendered_data):
     final_data = {}
 
     for component, ident in ID_MAP.items():
         if ident in rendered_data:
-            final_data[component] = data_access_functions[component](rendered_data[ident])
+            final_data[component] = GENERAL_FIGURE_DATA_FUNCTIONS[component](rendered_data[ident])
 
-    final_data['plot_info'] = {'bbox': get_plot_bbox()}
+    final_data['plot_info'] = {'bbox': _get_plot_bbox(figure_type, rendered_data)}
 
     return final_data
 
 
-def _get_bar_graph_categorical_data(source_data, rendered_data=None):
+def _get_bar_graph_categorical_data(source_data):
     source_bars = source_data['data'][0]
-    final_data = { 
+    return [{
         'name': 'bars',
         'x': source_bars['x'],
         'y': source_bars['y'],
         'labels': source_bars['labels'],
         'colors': source_bars['colors']
-    }
+    }]
 
-    if rendered_data:
-        rendered_bars = rendered_data['the_bars']['bars']
-        final_data['width'] = rendered_bars[0]['width'] if 'width' in rendered_bars[0] else rendered_bars[0]['height']
-        final_data['bboxes'] = map(lambda x: x['bbox'], rendered_bars)
 
-    return [final_data]
+def _add_bar_graph_categorical_rendered_data(models, rendered_data):
+    rendered_bars = rendered_data['the_bars']['bars']
+    models[0]['width'] = rendered_bars[0]['width'] if 'width' in rendered_bars[0] else rendered_bars[0]['height']
+    models[0]['bboxes'] = [x['bbox'] for x in rendered_bars]
 
 
-def _get_line_graph_data(source_data, rendered_data=None):
-    source_lines = source_data['data']
+def _get_line_graph_data(source_data):
+    return [{
+        'name': line['label'],
+        'x': line['x'],
+        'y': line['y'],
+        'color': line['color'],
+        'label': line['label']
+    } for line in source_data['data']]
 
-    final_data = []
 
-    for line in source_lines:
-        line_data = {   
-            'name': line['label'],
-            'x': line['x'],
-            'y': line['y'],
-            'color': line['color'],
-            'label': line['label']
-        }
+def _add_line_graph_rendered_data(models, rendered_data):
+    for line_data in models:
+        rendered_line = rendered_data[line_data['label']]
 
-        if rendered_data:
-            if 'points' in rendered_data[line['label']]:
-                bboxes = [x['bbox'] for x in rendered_data[line['label']]['points']]
-            else:
-                bboxes = [x['bbox'] for x in rendered_data[line['label']]['segments']]
+        if 'points' in rendered_line:
+            line_data['bboxes'] = [x['bbox'] for x in rendered_line['points']]
+        else:
+            line_data['bboxes'] = [x['bbox'] for x in rendered_line['segments']]
 
-            line_data['bboxes'] = bboxes
 
-        final_data.append(line_data)
+def _get_pie_chart_data(source_data):
+    source_wedges = source_data['data'][0]
+    return [{
+        'name': label,
+        'start': source_wedges['starts'][i],
+        'end': source_wedges['ends'][i],
+        'span': source_wedges['spans'][i],
+        'label': label
+    } for i, label in enumerate(source_wedges['labels'])]
+
+
+def _add_pie_chart_rendered_data(models, rendered_data):
+    if 'the_pie_labels' in rendered_data:
+        annotations_map = dict((x['text'], x['bbox']) for x in rendered_data['the_pie_labels']['labels'])
+    else:
+        annotations_map = {}
 
-    return final_data
+    for wedge_data in models:
+        label = wedge_data['label']
+        wedge_data['bbox'] = rendered_data[label]['slices'][0]['bbox']
 
+        if label in annotations_map:
+            wedge_data['annotation'] = {'bbox': annotations_map[label]}
 
-def _get_pie_chart_data(source_data, rendered_data=None):
-    source_wedges = source_data['data'][0]
-    final_data = []
 
-    if rendered_data and 'the_pie_labels' in rendered_data:
-        annotations_map = { text: bbox for text, bbox in zip([x['text'] for x in rendered_data['the_pie_labels']['labels']],
-                                                             [x['bbox'] for x in rendered_data['the_pie_labels']['labels']])}
-    else:
-        annotations_map = {}
+# (source-only models, rendered data merge) of each figure type
+MODEL_DATA_FUNCTIONS = {
+    'hbar_categorical': (_get_bar_graph_categorical_data, _add_bar_graph_categorical_rendered_data),
+    'vbar_categorical': (_get_bar_graph_categorical_data, _add_bar_graph_categorical_rendered_data),
+    'pie': (_get_pie_chart_data, _add_pie_chart_rendered_data),
+    'line': (_get_line_graph_data, _add_line_graph_rendered_data),
+    'dot_line': (_get_line_graph_data, _add_line_graph_rendered_data)
+}
 
-    for i, label in enumerate(source_wedges['labels']):
-        wedge_data = {
-            'name': label,
-            'start': source_wedges['starts'][i],
-            'end': source_wedges['ends'][i],
-            'span': source_wedges['spans'][i],
-            'label': label
-        }
 
-        if rendered_data:
-            wedge_data['bbox'] = rendered_data[label]['slices'][0]['bbox']
+def build_source_annotations(source_data):
+    """
+    Builds the annotations of a figure that only depend on its source data, i.e. everything but the
+    bounding boxes. Source values are referenced, not copied.
+    """
+    return {
+        'type': source_data['type'],
+        'general_figure_info': {},
+        'models': MODEL_DATA_FUNCTIONS[source_data['type']][0](source_data)
+    }
 
-            if label in annotations_map:
-                wedge_data['annotation'] = {'bbox': annotations_map[label]}
 
-        final_data.append(wedge_data)
-    
-    return final_data
+def merge_rendered_data(annotations, rendered_data):
+    """ Adds the bounding boxes of RENDERED_DATA to source-only ANNOTATIONS in place. """
+    annotations['general_figure_info'] = _get_general_figure_data(annotations['type'], rendered_data)
+    MODEL_DATA_FUNCTIONS[annotations['type']][1](annotations['models'], rendered_data)
+    return annotations
 
 
 def combine_source_and_rendered_data(source_data, rendered_data=None):
+    annotations = build_source_annotations(source_data)
 
-    model_data_access_functions = {
-        'hbar_categorical': _get_bar_graph_categorical_data,
-        'vbar_categorical': _get_bar_graph_categorical_data,
-        'pie': _get_pie_chart_data,
-        'line': _get_line_graph_data,
-        'dot_line': _get_line_graph_data
-    }
+    if rendered_data:
+        merge_rendered_data(annotations, rendered_data)
+
+    return annotations
+
+
+# Kinds of annotated elements, e.g. for flattening all the bounding boxes of a figure
+ELEMENT_TYPES = [
+    "figure", "plot", "title",
+    "bar", "wedge", "pie_label", "line_segment", "line_point",
+    "legend", "legend_label", "legend_preview",
+    "x_axis_rule", "x_axis_label", "x_major_tick", "x_minor_tick", "x_major_label", "x_gridline",
+    "y_axis_rule", "y_axis_label", "y_major_tick", "y_minor_tick", "y_major_label", "y_gridline"
+]
+
+MODEL_ELEMENT_TYPES = {
+    'vbar_categorical': "bar",
+    'hbar_categorical': "bar",
+    'pie': "wedge",
+    'line': "line_segment",
+    'dot_line': "line_point"
+}
 
-    final_data = {  
-        'type': source_data['type'],
-        'general_figure_info': _get_general_figure_data(source_data, rendered_data),
-        'models': model_data_access_functions[source_data['type']](source_data, rendered_data)
-    }
 
-    return final_data
+def _iter_general_bboxes(general):
+    if 'figure_info' in general:
+        yield "figure", -1, 0, general['figure_info']['bbox']['bbox']
+    if 'plot_info' in general:
+        yield "plot", -1, 0, general['plot_info']['bbox']
+    if 'title' in general:
+        yield "title", -1, 0, general['title']['bbox']
+
+
+def _iter_model_bboxes(annotations):
+    model_element = MODEL_ELEMENT_TYPES[annotations['type']]
+
+    for i, model in enumerate(annotations['models']):
+        if 'bboxes' in model:
+            bboxes = model['bboxes']
+        elif 'bbox' in model:
+            bboxes = [model['bbox']]
+        else:
+            bboxes = []
+
+        for j, bbox in enumerate(bboxes):
+            yield model_element, i, j, bbox
+
+        if 'annotation' in model:
+            yield "pie_label", i, 0, model['annotation']['bbox']
+
+
+def _iter_legend_bboxes(general, models):
+    if 'legend' not in general:
+        return
+
+    model_indices = dict((model['name'], i) for i, model in enumerate(models))
+
+    yield "legend", -1, 0, general['legend']['bbox']
+    for j, item in enumerate(general['legend']['items']):
+        model_index = model_indices.get(item.get('model'), -1)
+        yield "legend_label", model_index, j, item['label']['bbox']
+        yield "legend_preview", model_index, j, item['preview']['bbox']
+
+
+def _iter_axis_bboxes(general, axis):
+    axis_annot = general.get(axis + "_axis", {})
+
+    if 'rule' in axis_annot:
+        yield axis + "_axis_rule", -1, 0, axis_annot['rule']['bbox']
+    if 'label' in axis_annot:
+        yield axis + "_axis_label", -1, 0, axis_annot['label']['bbox']
+
+    for key in ["major_ticks", "minor_ticks", "major_labels"]:
+        element = "%s_%s" % (axis, key[:-1])
+        for j, bbox in enumerate(axis_annot.get(key, {}).get('bboxes', [])):
+            yield element, -1, j, bbox
+
+    for j, bbox in enumerate(general.get(axis + "_gridlines", {}).get('bboxes', [])):
+        yield axis + "_gridline", -1, j, bbox
+
+
+def iter_annotation_bboxes(annotations):
+    """
+    Yields (element_type, model_index, item_index, bbox) for every bounding box in a figure's
+    annotations. model_index is the position in 'models' of the plot element the box belongs to, or -1,
+    and item_index is the position of the box in its list, e.g. matching the 'labels' of a bar model.
+    """
+    general = annotations['general_figure_info']
+
+    return itertools.chain(_iter_general_bboxes(general),
+                           _iter_model_bboxes(annotations),
+                           _iter_legend_bboxes(general, annotations['models']),
+                           _iter_axis_bboxes(general, "x"),
+                           _iter_axis_bboxes(general, "y"))
 
 
 def hex_to_rgb(hexcode):
@@ -189,6 +294,19 @@ def hex_to_rgb(hexcode):
     return rgb
 
 
+def read_color_map(colors):
+    """ Maps each color name in the COLORS file to its id, hexcode, and RGB values. """
+    color_map = {}
+
+    with open(os.path.normpath(colors), 'r') as f:
+        for color_id, w in enumerate(f.readlines()):
+            name, color = w.split(',')
+            color = color.strip()
+            color_map[name] = {'id': color_id, 'hex': color, 'rgb': hex_to_rgb(color)}
+
+    return color_map
+
+
 def rgb_dist(a, b):
     return np.sqrt(np.sum([(x - y)**2 for x, y in zip(a, b)]))
 
@@ -1,9 +1,12 @@
 #!/usr/bin/python
 import click
 import json
+import logging
+import multiprocessing
 import os
 import signal
 import selenium.webdriver as seldriver
+import time
 import yaml
 
 from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
@@ -12,22 +15,231 @@ from tqdm import tqdm
 from bokeh.io import export_png_and_data
 from data_utils import combine_source_and_rendered_data
 from figure import *
+from image_encoding import encode_png, get_source_colors, PNG_MODES
+from mock_rendering import MockWebDriver
+from profiling import create_profiler, null_profile
+from render_cache import get_render_key, RenderCache
+from render_cost import RenderCostModel, get_figure_features, schedule_longest_first
+from render_trace import NULL_FIGURE_TRACE, RenderTrace
 from show_bounding_boxes import generate_all_images_with_bboxes_for_plot
 from questions.categorical import generate_bar_graph_questions, generate_pie_chart_questions
 from questions.lines import generate_line_plot_questions
 
 
+RENDER_BACKENDS = ["phantomjs", "mock"]
+
+
+def create_webdriver(render_backend="phantomjs"):
+    if render_backend == "mock":
+        return MockWebDriver()
+
+    return seldriver.PhantomJS()
+
+
+def quit_webdriver(webdriver):
+    if isinstance(webdriver, MockWebDriver):
+        webdriver.quit()
+        return
+
+    webdriver.service.process.send_signal(signal.SIGTERM)
+
+    try:
+        RemoteWebDriver.quit(webdriver)
+    except:
+        pass
+
+
+def _create_figure(source):
+    point_sets = source['data']
+    fig_type = source['type']
+
+    if fig_type == 'vbar_categorical':
+        return VBarGraphCategorical(point_sets[0], source['visuals'])
+    elif fig_type == 'hbar_categorical':
+        return HBarGraphCategorical(point_sets[0], source['visuals'])
+    elif fig_type == 'line':
+        return LinePlot(point_sets, source['visuals'])
+    elif fig_type == 'dot_line':
+        return DotLinePlot(point_sets, source['visuals'])
+    elif fig_type == 'pie':
+        return Pie(point_sets[0], source['visuals'])
+
+    return None
+
+
+def _export_figure(source, png_file, html_file, webdriver, trace=NULL_FIGURE_TRACE):
+    fig = _create_figure(source)
+    trace.lap("figure")
+
+    if not fig:
+        return None
+
+    # Export to HTML, PNG, and get rendered data
+    if isinstance(webdriver, MockWebDriver):
+        rendered_data = webdriver.export_png_and_data(source, png_file, html_file)
+    else:
+        rendered_data = export_png_and_data(fig.figure, png_file, html_file, webdriver)
+
+    trace.lap("export")
+    return rendered_data
+
+
+def _render_figures(fig_ids, source_data_json, destination_directory, webdriver, progress_position=0,
+                    add_bboxes=False, timings_file=None, png_mode=None, png_compress_level=6, cache_dir=None,
+                    trace_file=None, profile_dir=None, profile_every=1, profile_stage="figures"):
+
+    qa_json_dir = os.path.join(destination_directory, "json_qa")
+    annotations_json_dir = os.path.join(destination_directory, "json_annotations")
+    html_dir = destination_directory
+    png_dir = os.path.join(destination_directory, "png")
+    bbox_img_dir = os.path.join(destination_directory, "bbox_png")
+
+    timings_f = open(timings_file, 'a') if timings_file else None
+    cache = RenderCache(cache_dir) if cache_dir else None
+    trace = RenderTrace(trace_file) if trace_file else None
+    render_backend = "mock" if isinstance(webdriver, MockWebDriver) else "phantomjs"
+
+    profiler = create_profiler(profile_dir, profile_stage, profile_every)
+    profile = profiler.profile if profiler else null_profile
+
+    for fig_id in tqdm(iter(fig_ids), total=len(fig_ids), desc="Plotting figures", position=progress_position):
+        with profile(fig_id):
+            source = source_data_json['data'][fig_id]
+            fig_type = source['type']
+            figure_trace = trace.figure(fig_id, source) if trace else NULL_FIGURE_TRACE
+
+            html_file = os.path.join(html_dir, "%d_%s.html" % (fig_id, fig_type))
+            png_file = os.path.join(png_dir, "%d_%s.png" % (fig_id, fig_type))
+
+            # Reuse the previous render if nothing that affects the figure has changed
+            render_key = get_render_key(source, render_backend) if cache else None
+            rendered_data = cache.get(render_key, png_file) if cache else None
+            figure_trace.lap("cache")
+
+            if rendered_data is None:
+                start_time = time.time()
+                rendered_data = _export_figure(source, png_file, html_file, webdriver, figure_trace)
+
+                if rendered_data is None:
+                    continue
+
+                if timings_f:
+                    timing = get_figure_features(source)
+                    timing['fig_id'] = fig_id
+                    timing['seconds'] = time.time() - start_time
+                    timings_f.write(json.dumps(timing) + "\n")
+                    timings_f.flush()
+
+                if cache:
+                    cache.put(render_key, png_file, rendered_data)
+                    figure_trace.lap("cache")
+            else:
+                figure_trace.mark_cached()
+
+            if png_mode:
+                encode_png(png_file, mode=png_mode, compress_level=png_compress_level,
+                           palette_colors=get_source_colors(source))
+                figure_trace.lap("png_encoding")
+
+            all_plot_data = combine_source_and_rendered_data(source, rendered_data)
+            figure_trace.lap("annotations")
+
+            qa_json_file = os.path.join(qa_json_dir, "%s_%s.json" % (fig_id, fig_type))
+            annotations_json_file = os.path.join(annotations_json_dir, "%d_%s_annotations.json" % (fig_id, fig_type))
+
+            for qa in source['qa_pairs']:
+                qa['image'] = os.path.basename(png_file)
+                qa['annotations'] = os.path.basename(annotations_json_file)
+
+            with open(qa_json_file, 'w') as f:
+                json.dump({
+                    'qa_pairs': source['qa_pairs'],
+                    'total_distinct_questions': source_data_json['total_distinct_questions'],
+                    'total_distinct_colors': source_data_json['total_distinct_colors']
+                }, f)
+
+            with open(annotations_json_file, 'w') as f:
+                json.dump(all_plot_data, f)
+
+            figure_trace.lap("json")
+
+            if add_bboxes:
+                all_plot_data['image_index'] = fig_id
+                generate_all_images_with_bboxes_for_plot(all_plot_data, png_file, bbox_img_dir, 'red', load_image=True)
+                figure_trace.lap("bboxes")
+
+            # Cleanup
+            if os.path.exists(html_file):
+                os.remove(html_file)
+
+            if trace:
+                trace.write(figure_trace)
+
+    if timings_f:
+        timings_f.close()
+
+    if trace:
+        trace.close()
+
+    if cache:
+        logging.info("Render cache: %d hits, %d misses" % (cache.hits, cache.misses))
+
+    if profiler:
+        profiler.save()
+
+
+def _render_partition(worker, fig_ids, source_data_json, destination_directory, render_backend, render_options):
+    webdriver = create_webdriver(render_backend)
+
+    try:
+        _render_figures(fig_ids, source_data_json, destination_directory, webdriver, progress_position=worker,
+                        profile_stage="figures-worker%d" % worker, **render_options)
+    finally:
+        quit_webdriver(webdriver)
+
+
+def _render_in_parallel(source_data_json, destination_directory, n_workers, cost_model, render_backend,
+                        render_options):
+    partitions = schedule_longest_first(source_data_json['data'], n_workers, cost_model)
+
+    workers = []
+    for worker, (fig_ids, eta) in enumerate(partitions):
+        logging.info("Worker %d: %d figures, ETA %.0fs" % (worker, len(fig_ids), eta))
+
+        process = multiprocessing.Process(target=_render_partition,
+                                          args=(worker, fig_ids, source_data_json, destination_directory,
+                                                render_backend, render_options))
+        process.start()
+        workers.append(process)
+
+    for process in workers:
+        process.join()
+
+    failed = [worker for worker, process in enumerate(workers) if process.exitcode != 0]
+    if failed:
+        raise Exception("Render workers %s failed!" % failed)
+
+
 def generate_figures (
         source_data_json,
         destination_directory,
         add_bboxes=False,
-        supplied_webdriver=None
+        supplied_webdriver=None,
+        n_workers=1,
+        cost_model_json=None,
+        timings_file=None,
+        trace_file=None,
+        render_backend="phantomjs",
+        png_mode=None,
+        png_compress_level=6,
+        cache_dir=None,
+        profile_dir=None,
+        profile_every=1
     ):
 
     # Setup dest dirs
     qa_json_dir = os.path.join(destination_directory, "json_qa")
     annotations_json_dir = os.path.join(destination_directory, "json_annotations")
-    html_dir = destination_directory
     png_dir = os.path.join(destination_directory, "png")
 
     dirs = [destination_directory, qa_json_dir, annotations_json_dir, png_dir]
@@ -40,88 +252,76 @@ def generate_figures (
         if not os.path.exists(dirpath):
             os.mkdir(dirpath)
 
-    # Create web driver
-    if supplied_webdriver:
-        webdriver = supplied_webdriver
-    else:
-        webdriver = seldriver.PhantomJS()
-
     # Read in the synthetic data
     with open(source_data_json, 'r') as f:
         source_data_json = json.load(f)
 
-    for fig_id, source in tqdm(iter(enumerate(source_data_json['data'])), total=len(source_data_json['data']), desc="Plotting figures"):
+    render_options = {
+        'add_bboxes': add_bboxes,
+        'timings_file': timings_file,
+        'trace_file': trace_file,
+        'png_mode': png_mode,
+        'png_compress_level': png_compress_level,
+        'cache_dir': cache_dir,
+        'profile_dir': profile_dir,
+        'profile_every': profile_every
+    }
 
-        point_sets = source['data']
+    # Schedule the figures across several web drivers, most expensive first
+    if n_workers > 1:
+        if supplied_webdriver:
+            logging.warning("Ignoring the supplied web driver, each of the %d render workers starts its own" % n_workers)
 
-        fig = None
-        fig_type = source['type']
-
-        if fig_type == 'vbar_categorical':
-            fig = VBarGraphCategorical(point_sets[0], source['visuals'])
-        elif fig_type == 'hbar_categorical':
-            fig = HBarGraphCategorical(point_sets[0], source['visuals'])
-        elif fig_type == 'line':
-            fig = LinePlot(point_sets, source['visuals'])
-        elif fig_type == 'dot_line':
-            fig = DotLinePlot(point_sets, source['visuals'])
-        elif fig_type == 'pie':
-            fig = Pie(point_sets[0], source['visuals'])
-
-        if not fig:
-            continue
-
-        html_file = os.path.join(html_dir, "%d_%s.html" % (fig_id, fig_type))
-        png_file = os.path.join(png_dir, "%d_%s.png" % (fig_id, fig_type))
-
-        # Export to HTML, PNG, and get rendered data
-        rendered_data = export_png_and_data(fig.figure, png_file, html_file, webdriver)
+        cost_model = RenderCostModel.load(cost_model_json) if cost_model_json else RenderCostModel()
+        _render_in_parallel(source_data_json, destination_directory, n_workers, cost_model, render_backend,
+                            render_options)
+        return
 
-        all_plot_data = combine_source_and_rendered_data(source, rendered_data)
-
-        qa_json_file = os.path.join(qa_json_dir, "%s_%s.json" % (fig_id, fig_type))
-        annotations_json_file = os.path.join(annotations_json_dir, "%d_%s_annotations.json" % (fig_id, fig_type))
-
-        for qa in source['qa_pairs']:
-            qa['image'] = os.path.basename(png_file)
-            qa['annotations'] = os.path.basename(annotations_json_file)
-
-        with open(qa_json_file, 'w') as f:
-            json.dump({
-                'qa_pairs': source['qa_pairs'], 
-                'total_distinct_questions': source_data_json['total_distinct_questions'],
-                'total_distinct_colors': source_data_json['total_distinct_colors']
-            }, f)
-
-        with open(annotations_json_file, 'w') as f:
-            json.dump(all_plot_data, f)
-
-        if add_bboxes:
-            all_plot_data['image_index'] = fig_id
-            generate_all_images_with_bboxes_for_plot(all_plot_data, png_file, bbox_img_dir, 'red', load_image=True)
+    # Create web driver
+    if supplied_webdriver:
+        webdriver = supplied_webdriver
+    else:
+        webdriver = create_webdriver(render_backend)
 
-        # Cleanup
-        os.remove(html_file)
+    _render_figures(range(len(source_data_json['data'])), source_data_json, destination_directory, webdriver,
+                    **render_options)
 
     # Kill the newly created webdriver
     if not supplied_webdriver:
-        webdriver.service.process.send_signal(signal.SIGTERM)
-        try:
-            RemoteWebDriver.quit(webdriver)
-        except:
-            pass
+        quit_webdriver(webdriver)
 
 
 @click.command()
 @click.argument("source_data_json")
 @click.argument("destination_directory")
-@click.option("--add-bboxes", flag_value=True, 
+@click.option("--add-bboxes", flag_value=True,
                 help="option to generate figures with bounding box annotations as well")
+@click.option("-w", "--n-workers", default=1, type=int,
+                help="number of web drivers to render with in parallel")
+@click.option("--cost-model-json", default=None,
+                help="render cost model from 'render_cost.py' used to balance figures across workers")
+@click.option("--timings-file", default=None,
+                help="file to append per-figure render timings to, for calibrating the render cost model")
+@click.option("--trace-file", default=None,
+                help="file to append the time of each phase of rendering each figure to, summarized by 'render_trace.py'")
+@click.option("--render-backend", default="phantomjs", type=click.Choice(RENDER_BACKENDS),
+                help="'mock' skips the browser and writes blank images with synthetic annotations, for benchmarking")
+@click.option("--png-mode", default=None, type=click.Choice(PNG_MODES),
+                help="re-encode the images as RGBA, RGB, or lossless palette ('P') images")
+@click.option("--png-compress-level", default=6, type=click.IntRange(0, 9),
+                help="zlib compression level for re-encoded images")
+@click.option("--cache-dir", default=None,
+                help="directory of previously rendered figures to reuse when a figure's data and visuals are unchanged")
+@click.option("--profile", "profile_dir", default=None,
+                help="directory to write cProfile stats and collapsed stacks of the rendering to, one set per worker")
+@click.option("--profile-every", default=1, type=int,
+                help="with '--profile', only profile every Nth figure to keep the overhead low")
 def main(**kwargs):
     """
     Generates figures from SOURCE_DATA_JSON generated with 'synthetic_data_generation.py' and saves
     them to DESTINATION_DIRECTORY.
     """
+    logging.basicConfig(level=logging.INFO)
     generate_figures(**kwargs)
 
 
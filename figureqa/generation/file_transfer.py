@@ -0,0 +1,71 @@
+#!/usr/bin/python
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+TRANSFER_MODES = ["copy", "hardlink", "symlink", "rename", "reflink"]
+
+# From linux/fs.h, clones a whole file on copy-on-write filesystems (Btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+
+    with open(src, 'rb') as src_f:
+        with open(dst, 'wb') as dst_f:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+
+
+def _remove_existing(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def transfer_file(src, dst, mode="copy"):
+    """
+    Puts the file SRC at DST using one of TRANSFER_MODES. Hard links, renames, and reflinks fall
+    back to a copy (a move, for renames) when SRC and DST are on different filesystems or the
+    filesystem doesn't support them.
+
+    Returns the mode that was actually used.
+    """
+    # Links from a previous run would otherwise be written through, into SRC's directory
+    _remove_existing(dst)
+
+    if mode == "copy":
+        shutil.copy(src, dst)
+        return mode
+
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return mode
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+        elif mode == "rename":
+            os.rename(src, dst)
+        elif mode == "reflink":
+            _reflink(src, dst)
+        else:
+            raise ValueError("Unknown transfer mode '%s'!" % mode)
+
+        return mode
+
+    except (IOError, OSError):
+        _remove_existing(dst)
+
+        if mode == "rename":
+            shutil.move(src, dst)
+            return "move"
+
+        shutil.copy(src, dst)
+        return "copy"
@@ -1,21 +1,50 @@
 #!/usr/bin/python
 import click
 import copy
+import json
 import logging
 import os
-import selenium.webdriver as seldriver
+import platform
+import time
 import yaml
 
-from figure_generation import generate_figures
+from figure_generation import create_webdriver, generate_figures, quit_webdriver, RENDER_BACKENDS
 from json_combiner import combine_figure_data
+from memory_usage import MemoryMonitor
 from source_data_generation import generate_source_data
 
 
+RUN_REPORT_FILE = "run_report.json"
+
+
+def _write_run_report(run_report_json, run_info, start_time, memory, finished=False):
+    report = dict(run_info)
+    report.update({
+        'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time)),
+        'seconds': time.time() - start_time,
+        'finished': finished,
+        'memory': memory.report()
+    })
+
+    # Replaced in one step, so a run killed while writing still leaves the previous report
+    with open(run_report_json + ".tmp", 'w') as f:
+        json.dump(report, f, indent=4)
+    os.rename(run_report_json + ".tmp", run_report_json)
+
+
 @click.command()
 @click.argument("generation_yaml")
 @click.option("--share-webdriver/--new-webdriver", default=True,
-                help="whether or not to share a webdriver between all calls to 'generate_figures'")
-def main(generation_yaml, share_webdriver):
+                help="whether or not to share a webdriver between all calls to 'generate_figures' when 'render_workers' is 1")
+@click.option("--render-backend", default="phantomjs", type=click.Choice(RENDER_BACKENDS),
+                help="'mock' skips the browser entirely, to benchmark everything around rendering")
+@click.option("--profile", "profile_dir", default=None,
+                help="directory to write cProfile stats of every stage to, by split and partition")
+@click.option("--profile-every", default=1, type=int,
+                help="with '--profile', only profile every Nth figure to keep the overhead low")
+@click.option("--trace-malloc", default=0, type=int,
+                help="record this many of the lines allocating the most memory in each stage, with tracemalloc (slow)")
+def main(generation_yaml, share_webdriver, render_backend, profile_dir, profile_every, trace_malloc):
     """
     Produces a dataset from the config described in GENERATION_YAML.
     """
@@ -24,8 +53,12 @@ def main(generation_yaml, share_webdriver):
     with open(generation_yaml, 'r') as f:
         config = yaml.load(f)
 
-    # Create a single webdriver for serial generation
-    webdriver = seldriver.PhantomJS() if share_webdriver else None
+    start_time = time.time()
+
+    # Create a single webdriver for serial generation, parallel render workers start their own
+    render_workers = config.get('render_workers', 1)
+    share_webdriver = share_webdriver and render_workers <= 1
+    webdriver = create_webdriver(render_backend) if share_webdriver else None
 
     working_dir = os.path.normpath(config['working_directory']) if 'working_directory' in config else "working_generation"
     dest_dir = os.path.normpath(config['destination_directory']) if 'destination_directory' in config else "final_generation"
@@ -36,6 +69,15 @@ def main(generation_yaml, share_webdriver):
     if not os.path.exists(dest_dir):
         os.mkdir(dest_dir)
 
+    # The report is saved as each stage starts and ends, so runs killed for memory still leave one
+    run_report_json = os.path.join(dest_dir, RUN_REPORT_FILE)
+    run_info = {'generation_yaml': generation_yaml, 'render_backend': render_backend,
+                'python': platform.python_version()}
+    memory = MemoryMonitor(trace_top=trace_malloc,
+                           on_change=lambda: _write_run_report(run_report_json, run_info, start_time, memory))
+
+    png_encoding = config.get('png_encoding', {})
+
     for split in config['splits']:
 
         working_sub_dir = os.path.join(working_dir, split['name'])
@@ -46,6 +88,7 @@ def main(generation_yaml, share_webdriver):
 
         for partition in split['partitions']:
             partition_dir = os.path.join(working_sub_dir, partition['name'])
+            partition_profile_dir = os.path.join(profile_dir, split['name'], partition['name']) if profile_dir else None
 
             if not os.path.exists(partition_dir):
                 os.mkdir(partition_dir)
@@ -54,6 +97,8 @@ def main(generation_yaml, share_webdriver):
             del source_data_args['name']
 
             source_data_args['output_file_json'] = os.path.join(partition_dir, "source_data.json")
+            source_data_args['profile_dir'] = partition_profile_dir
+            source_data_args['profile_every'] = profile_every
 
             # Add missing arguments if they aren't present
             for arg in ['common_config_yaml', 'colors', 'keep_all_questions']:
@@ -61,7 +106,8 @@ def main(generation_yaml, share_webdriver):
                     source_data_args[arg] = config[arg]
 
             logging.info("Generating source data for %s/%s" % (split['name'], partition['name']))
-            generate_source_data(**source_data_args)
+            with memory.stage("source_data", split=split['name'], partition=partition['name']):
+                generate_source_data(**source_data_args)
 
             generated_figures_dir = os.path.join(partition_dir, "figure_data")
             if not os.path.exists(generated_figures_dir):
@@ -70,7 +116,13 @@ def main(generation_yaml, share_webdriver):
             partition_figure_data_dirs.append(generated_figures_dir)
 
             logging.info("Generating figures for %s/%s" % (split['name'], partition['name']))
-            generate_figures(source_data_args['output_file_json'], generated_figures_dir, supplied_webdriver=webdriver)
+            with memory.stage("figures", split=split['name'], partition=partition['name']):
+                generate_figures(source_data_args['output_file_json'], generated_figures_dir,
+                                 supplied_webdriver=webdriver, n_workers=render_workers,
+                                 cost_model_json=config.get('render_cost_model'), render_backend=render_backend,
+                                 png_mode=png_encoding.get('mode'), png_compress_level=png_encoding.get('compress_level', 6),
+                                 cache_dir=config.get('render_cache_directory'),
+                                 profile_dir=partition_profile_dir, profile_every=profile_every)
 
         logging.info("Combining data for %s" % split['name'])
 
@@ -78,20 +130,17 @@ def main(generation_yaml, share_webdriver):
         if not os.path.exists(combined_data_dir):
             os.mkdir(combined_data_dir)
 
-        combine_figure_data(combined_data_dir, partition_figure_data_dirs)
+        with memory.stage("combine", split=split['name']):
+            combine_figure_data(combined_data_dir, partition_figure_data_dirs,
+                                transfer_mode=config.get('combine_transfer_mode', "copy"),
+                                profile_dir=os.path.join(profile_dir, split['name']) if profile_dir else None,
+                                profile_every=profile_every)
 
     # Kill the shared webdriver
     if share_webdriver:
-        import signal
-        from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
-
-        webdriver.service.process.send_signal(signal.SIGTERM)
-
-        try:
-            RemoteWebDriver.quit(webdriver)
-        except:
-            pass
+        quit_webdriver(webdriver)
 
+    _write_run_report(run_report_json, run_info, start_time, memory, finished=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import click
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from data_utils import hex_to_rgb
+
+
+PNG_MODES = ["RGBA", "RGB", "P"]
+
+MAX_PALETTE_COLORS = 256
+
+
+def get_source_colors(source):
+    """ Returns the hex colors of the plot elements in a source data record. """
+    if source['type'] in ['line', 'dot_line']:
+        return [point_set['color'] for point_set in source['data']]
+
+    return list(source['data'][0]['colors'])
+
+
+def _flatten_alpha(image):
+    """ Composites an image with transparency onto white, which is how the figures are displayed. """
+    if image.mode not in ["RGBA", "LA", "P"]:
+        return image.convert("RGB")
+
+    image = image.convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, image).convert("RGB")
+
+
+def _quantize_lossless(image, palette_colors=None):
+    """
+    Converts IMAGE to palette mode without changing any pixel. Returns None if the image has more
+    colors than fit in a palette. PALETTE_COLORS are placed first so their indices are stable.
+    """
+    pixels = np.asarray(image, dtype=np.uint32)
+    height, width = pixels.shape[:2]
+    keys = (pixels[:, :, 0] << 16) | (pixels[:, :, 1] << 8) | pixels[:, :, 2]
+
+    unique_keys, inverse = np.unique(keys.ravel(), return_inverse=True)
+
+    if len(unique_keys) > MAX_PALETTE_COLORS:
+        return None
+
+    # Order the palette with the known plot colors first
+    order = []
+    present = dict((int(k), i) for i, k in enumerate(unique_keys))
+
+    for hexcode in (palette_colors or []):
+        r, g, b = hex_to_rgb(hexcode)
+        key = (r << 16) | (g << 8) | b
+        if key in present and present[key] not in order:
+            order.append(present[key])
+
+    seeded = set(order)
+    order += [i for i in range(len(unique_keys)) if i not in seeded]
+
+    remap = np.zeros(len(unique_keys), dtype=np.uint8)
+    remap[order] = np.arange(len(order), dtype=np.uint8)
+
+    palette = []
+    for i in order:
+        key = int(unique_keys[i])
+        palette += [(key >> 16) & 0xff, (key >> 8) & 0xff, key & 0xff]
+
+    quantized = Image.fromarray(remap[inverse].reshape(height, width), "P")
+    quantized.putpalette(palette)
+
+    return quantized
+
+
+def encode_png(png_file, mode="RGBA", compress_level=6, palette_colors=None, output_file=None):
+    """
+    Re-encodes PNG_FILE with the given pixel MODE and zlib COMPRESS_LEVEL. Mode "P" quantizes to a
+    palette losslessly, falling back to "RGB" when the image has more than 256 distinct colors.
+
+    Returns the mode that was written.
+    """
+    output_file = output_file if output_file else png_file
+
+    image = Image.open(png_file)
+    image.load()
+
+    if mode != "RGBA":
+        rgb_image = _flatten_alpha(image)
+        image = rgb_image
+
+        if mode == "P":
+            image = _quantize_lossless(rgb_image, palette_colors)
+
+            if image is None:
+                logging.debug("Too many colors to quantize %s, writing RGB instead" % png_file)
+                image, mode = rgb_image, "RGB"
+
+    elif image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    image.save(output_file, format="PNG", compress_level=compress_level)
+
+    return mode
+
+
+@click.command()
+@click.argument("png_directory")
+@click.option("-m", "--mode", default="P", type=click.Choice(PNG_MODES),
+                help="pixel format to write, 'P' being lossless palette quantization")
+@click.option("-l", "--compress-level", default=9, type=click.IntRange(0, 9),
+                help="zlib compression level")
+def main(png_directory, mode, compress_level):
+    """
+    Re-encodes, in place, all the PNG images in PNG_DIRECTORY.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    png_files = [os.path.join(png_directory, fp) for fp in os.listdir(png_directory) if fp.endswith(".png")]
+    size_before = sum([os.path.getsize(fp) for fp in png_files])
+
+    for png_file in tqdm(iter(png_files), total=len(png_files), desc="Encoding images"):
+        encode_png(png_file, mode=mode, compress_level=compress_level)
+
+    size_after = sum([os.path.getsize(fp) for fp in png_files])
+    logging.info("Re-encoded %d images: %d bytes -> %d bytes" % (len(png_files), size_before, size_after))
+
+
+if __name__ == "__main__":
+    main()
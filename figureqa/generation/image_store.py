@@ -0,0 +1,153 @@
+#!/usr/bin/python
+from __future__ import division
+
+import click
+import json
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+
+STORE_MANIFEST_FILE = "image_store.json"
+STORE_INDEX_FILE = "image_store_index.npz"
+
+CHANNEL_MODES = {3: "RGB", 4: "RGBA"}
+
+
+def _bucket_width(width, bucket_width):
+    if bucket_width <= 0:
+        return 0
+    return int(np.ceil(width / bucket_width) * bucket_width)
+
+
+def _init_worker(directory, buckets, channels):
+    global worker_arrays
+    global worker_mode
+    worker_arrays = [np.memmap(os.path.join(directory, bucket['file']), dtype=np.uint8, mode='r+',
+                               shape=tuple(bucket['shape'])) for bucket in buckets]
+    worker_mode = CHANNEL_MODES[channels]
+
+
+def _decode_into_store(task):
+    png_file, bucket, slot = task
+    image = np.asarray(Image.open(png_file).convert(worker_mode))
+    worker_arrays[bucket][slot, :image.shape[0], :image.shape[1]] = image
+
+
+def export_image_store(
+        split_directory,
+        output_directory=None,
+        channels=3,
+        bucket_width=0,
+        n_workers=None
+    ):
+    """
+    Decodes every image in the png/ directory of a combined split into uint8 arrays that can be
+    memory-mapped. Images are zero-padded to the largest size in their bucket; with BUCKET_WIDTH > 0,
+    images are grouped by width rounded up to a multiple of it, otherwise there is a single bucket.
+    """
+    output_directory = output_directory if output_directory else os.path.join(split_directory, "image_store")
+    png_dir = os.path.join(split_directory, "png")
+
+    if not os.path.exists(output_directory):
+        os.mkdir(output_directory)
+
+    image_indices = sorted([int(fp.replace(".png", "")) for fp in os.listdir(png_dir) if fp.endswith(".png")])
+    if image_indices != list(range(len(image_indices))):
+        raise Exception("Expected images 0.png to %d.png in %s!" % (len(image_indices) - 1, png_dir))
+
+    # Opening an image only reads its header
+    sizes = [Image.open(os.path.join(png_dir, "%d.png" % i)).size for i in tqdm(image_indices, desc="Reading sizes")]
+    widths = np.array([w for w, h in sizes], dtype=np.int32)
+    heights = np.array([h for w, h in sizes], dtype=np.int32)
+
+    keys = [_bucket_width(w, bucket_width) for w in widths]
+    bucket_keys = sorted(set(keys))
+    bucket_ids = np.array([bucket_keys.index(k) for k in keys], dtype=np.int32)
+    slots = np.zeros(len(image_indices), dtype=np.int32)
+
+    buckets = []
+    for bucket_id, key in enumerate(bucket_keys):
+        members = np.where(bucket_ids == bucket_id)[0]
+        slots[members] = np.arange(len(members))
+
+        shape = [len(members), int(heights[members].max()), int(widths[members].max()), channels]
+        buckets.append({'file': "images_%d.uint8" % bucket_id, 'shape': shape})
+
+        # Allocate the (sparse) file up front so workers can write to it
+        np.memmap(os.path.join(output_directory, buckets[-1]['file']), dtype=np.uint8, mode='w+', shape=tuple(shape)).flush()
+
+    tasks = [(os.path.join(png_dir, "%d.png" % i), int(bucket_ids[i]), int(slots[i])) for i in image_indices]
+
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(output_directory, buckets, channels))
+
+    try:
+        for _ in tqdm(pool.imap_unordered(_decode_into_store, tasks, chunksize=64), total=len(tasks), desc="Decoding images"):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+
+    np.savez(os.path.join(output_directory, STORE_INDEX_FILE), bucket=bucket_ids, slot=slots, height=heights, width=widths)
+
+    with open(os.path.join(output_directory, STORE_MANIFEST_FILE), 'w') as f:
+        json.dump({'num_images': len(image_indices), 'channels': channels, 'buckets': buckets}, f, indent=4)
+
+
+class ImageStore (object):
+    """
+    Read-only view of a store written by 'export_image_store'. Indexing by image index returns the
+    image as an (h, w, channels) uint8 array sliced from the memory map, without decoding or copying.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, STORE_MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+
+        index = np.load(os.path.join(directory, STORE_INDEX_FILE))
+        self.bucket = index['bucket']
+        self.slot = index['slot']
+        self.height = index['height']
+        self.width = index['width']
+
+        self.arrays = [np.memmap(os.path.join(directory, bucket['file']), dtype=np.uint8, mode='r',
+                                 shape=tuple(bucket['shape'])) for bucket in self.manifest['buckets']]
+
+    def __len__(self):
+        return self.manifest['num_images']
+
+    def __getitem__(self, image_index):
+        return self.padded(image_index)[:self.height[image_index], :self.width[image_index]]
+
+    def padded(self, image_index):
+        """ Returns the image with the zero padding of its bucket. """
+        return self.arrays[self.bucket[image_index]][self.slot[image_index]]
+
+    def shape(self, image_index):
+        return (int(self.height[image_index]), int(self.width[image_index]), self.manifest['channels'])
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--output-directory", default=None,
+                help="where to write the store, defaults to image_store/ in SPLIT_DIRECTORY")
+@click.option("-c", "--channels", default="3", type=click.Choice(["3", "4"]),
+                help="3 for RGB, 4 for RGBA")
+@click.option("-b", "--bucket-width", default=0, type=int,
+                help="group images by width rounded up to a multiple of this, instead of padding all to the widest")
+@click.option("-w", "--n-workers", default=None, type=int,
+                help="number of decoding processes, defaults to the number of CPUs")
+def main(split_directory, output_directory, channels, bucket_width, n_workers):
+    """
+    Decodes the images of SPLIT_DIRECTORY, produced by 'json_combiner.py', into a memory-mappable store.
+    """
+    logging.basicConfig(level=logging.INFO)
+    export_image_store(split_directory, output_directory, int(channels), bucket_width, n_workers)
+
+
+if __name__ == "__main__":
+    main()
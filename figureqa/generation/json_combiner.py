@@ -4,83 +4,286 @@ import json
 import logging
 import os
 import re
-import shutil
 
+from collections import Counter
+from multiprocessing.pool import ThreadPool
 from tqdm import tqdm
 
+from file_transfer import transfer_file, TRANSFER_MODES
+from json_streaming import JSONArrayWriter, split_json_object
+from profiling import create_profiler, null_profile
+from record_shards import RecordShardWriter
 
-def combine_figure_data(
-        destination_directory,
-        source_directories,
-        stop_index=-1
-    ):
 
-    if not os.path.exists(destination_directory):
-        os.mkdir(destination_directory)
+COMBINE_MANIFEST_FILE = "combine.json"
+
+
+def _get_fig_id(image_file):
+    return int(re.match(r'^[0-9]+', os.path.basename(image_file)).group(0))
+
+
+def _list_figures(src_dir, stop_index=-1):
+    """ Returns the image names of SRC_DIR in order of figure id, up to STOP_INDEX. """
+    image_names = [fp.replace(".png", "") for fp in os.listdir(os.path.join(src_dir, "png")) if fp.endswith(".png")]
+    image_names = sorted(image_names, key=_get_fig_id)
+
+    if stop_index >= 0:
+        image_names = [name for name in image_names if _get_fig_id(name) < stop_index]
+
+    return image_names
+
+
+def _load_figure(task):
+    src_dir, image_name, image_index, dest_png_dir, transfer_mode = task
+    png_file = os.path.join(src_dir, "png", "%s.png" % image_name)
+
+    # Copy or link image to new location, or read it in to pack into a shard
+    if dest_png_dir:
+        transferred_mode = transfer_file(png_file, os.path.join(dest_png_dir, "%d.png" % image_index), transfer_mode)
+        png_bytes = None
+    else:
+        transferred_mode = None
+        with open(png_file, 'rb') as f:
+            png_bytes = f.read()
+
+    # Read annotations
+    with open(os.path.join(src_dir, "json_annotations", "%s_annotations.json" % image_name), 'r') as f:
+        annotations = json.load(f)
+        annotations['image_index'] = image_index
+
+    # Read QA pairs
+    with open(os.path.join(src_dir, "json_qa", "%s.json" % image_name), 'r') as f:
+        qa_data = json.load(f)
+
+    for qa in qa_data['qa_pairs']:
+        del qa['image']
+        del qa['annotations']
+        qa['image_index'] = image_index
+
+    return annotations, qa_data, transferred_mode, png_bytes
+
+
+def _load_figures(pool, tasks, n_threads, profile=null_profile):
+    """ Loads figures on POOL in order, keeping a bounded number of them in flight. """
+    window = 64 * n_threads
+
+    def load_figure(task):
+        with profile(task[2]):
+            return _load_figure(task)
+
+    for i in range(0, len(tasks), window):
+        for result in pool.imap(load_figure, tasks[i:i + window], chunksize=4):
+            yield result
+
+
+def _get_qa_json_object(qa_data):
+    return {
+        'qa_pairs': [],
+        'total_distinct_questions': qa_data['total_distinct_questions'] if qa_data else None,
+        'total_distinct_colors': qa_data['total_distinct_colors'] if qa_data else None
+    }
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime * 1e6)]
+
+
+def _read_combine_manifest(destination_directory):
+    manifest_file = os.path.join(destination_directory, COMBINE_MANIFEST_FILE)
+
+    if not os.path.exists(manifest_file):
+        return None
+
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    # The arrays are truncated at the recorded offsets, so the files must be exactly as that run left them
+    for name in ["annotations.json", "qa_pairs.json"]:
+        json_file = os.path.join(destination_directory, name)
+
+        if not os.path.exists(json_file) or manifest.get('signatures', {}).get(name) != _file_signature(json_file):
+            raise Exception("%s in %s changed since it was combined, it must be combined again without 'append'!"
+                            % (name, destination_directory))
+
+    return manifest
+
+
+def _reopen_json_array(json_file, array_end):
+    """ Opens JSON_FILE for writing at ARRAY_END, the offset of the closing ']' of its array. """
+    f = open(json_file, 'r+')
+    f.seek(array_end)
+    f.truncate()
+    return f
+
+
+class _JSONSplitWriter (object):
+    """
+    Streams a split to qa_pairs.json and annotations.json, with images under png/. With a MANIFEST of
+    a previous run, both arrays are extended in place from where that run ended.
+    """
+
+    def __init__(self, destination_directory, manifest=None):
+        self.destination_directory = destination_directory
+        self.qa_writer, self.qa_tail = None, ""
+
+        if manifest:
+            self.annotations_json_file = _reopen_json_array(os.path.join(destination_directory, "annotations.json"),
+                                                            manifest['annotations_array_end'])
+            self.qa_json_file = _reopen_json_array(os.path.join(destination_directory, "qa_pairs.json"),
+                                                   manifest['qa_pairs_array_end'])
+
+            self.annotations_writer = JSONArrayWriter.resume(self.annotations_json_file, manifest['num_images'])
+            self.num_qa_pairs = manifest['num_qa_pairs']
+
+            # The totals of the previous run are kept, unless it had no QA pairs to take them from
+            if self.num_qa_pairs > 0:
+                self.qa_writer = JSONArrayWriter.resume(self.qa_json_file, self.num_qa_pairs)
+                self.qa_tail = manifest['qa_pairs_tail']
+        else:
+            self.qa_json_file = open(os.path.join(destination_directory, "qa_pairs.json"), 'w')
+            self.annotations_json_file = open(os.path.join(destination_directory, "annotations.json"), 'w')
+
+            self.annotations_writer = JSONArrayWriter(self.annotations_json_file)
+            self.num_qa_pairs = 0
+
+    def _open_qa_writer(self, qa_data):
+        qa_head, self.qa_tail = split_json_object(_get_qa_json_object(qa_data), 'qa_pairs')
+
+        # Replaces the output of a previous run that had no QA pairs
+        self.qa_json_file.seek(0)
+        self.qa_json_file.truncate()
+        self.qa_writer = JSONArrayWriter(self.qa_json_file, qa_head)
+
+    def write(self, annotations, qa_data, png_bytes=None):
+        self.annotations_writer.write(annotations)
+
+        # The totals may come before the QA pairs in the output, so wait for them before writing
+        if not self.qa_writer and len(qa_data['qa_pairs']) > 0:
+            self._open_qa_writer(qa_data)
+
+        for qa in qa_data['qa_pairs']:
+            self.qa_writer.write(qa)
+
+        self.num_qa_pairs += len(qa_data['qa_pairs'])
+
+    def close(self):
+        if not self.qa_writer:
+            self._open_qa_writer(None)
+
+        self.annotations_writer.close()
+        self.qa_writer.close(self.qa_tail)
+
+        self.annotations_json_file.close()
+        self.qa_json_file.close()
+
+        # Where the next run with 'append' continues from
+        with open(os.path.join(self.destination_directory, COMBINE_MANIFEST_FILE), 'w') as f:
+            json.dump({
+                'num_images': self.annotations_writer.count,
+                'num_qa_pairs': self.num_qa_pairs,
+                'annotations_array_end': self.annotations_writer.end,
+                'qa_pairs_array_end': self.qa_writer.end,
+                'qa_pairs_tail': self.qa_tail,
+                'signatures': dict((name, _file_signature(os.path.join(self.destination_directory, name)))
+                                   for name in ["annotations.json", "qa_pairs.json"])
+            }, f, indent=4)
+
+
+class _ShardSplitWriter (object):
+    """ Packs a split into record shards, see 'record_shards.py'. """
+
+    def __init__(self, destination_directory, shard_size, append=False):
+        self.shard_writer = RecordShardWriter(destination_directory, shard_size, append)
+        self.totals = None
+
+    def write(self, annotations, qa_data, png_bytes=None):
+        if not self.totals and len(qa_data['qa_pairs']) > 0:
+            self.totals = (qa_data['total_distinct_questions'], qa_data['total_distinct_colors'])
+
+        self.shard_writer.write(annotations['image_index'], png_bytes, annotations, qa_data['qa_pairs'])
+
+    def close(self):
+        self.shard_writer.close(*(self.totals if self.totals else (None, None)))
+
+
+def _open_split_writer(destination_directory, output_format, shard_size, append):
+    """ Returns the writer of OUTPUT_FORMAT, the directory to put images in, and the first new image index. """
+    if output_format == "shards":
+        split_writer = _ShardSplitWriter(destination_directory, shard_size, append)
+        return split_writer, None, split_writer.shard_writer.num_images
 
     dest_png_dir = os.path.join(destination_directory, "png")
 
     if not os.path.exists(dest_png_dir):
         os.mkdir(dest_png_dir)
 
-    image_index = 0
-    all_annotations = []
-    all_qas = []
-    total_distinct_questions, total_distinct_colors = None, None
+    manifest = _read_combine_manifest(destination_directory) if append else None
+    if append and not manifest and os.path.exists(os.path.join(destination_directory, "annotations.json")):
+        raise Exception("No %s in %s to append to, it must be combined again without 'append'!"
+                        % (COMBINE_MANIFEST_FILE, destination_directory))
+
+    return _JSONSplitWriter(destination_directory, manifest), dest_png_dir, manifest['num_images'] if manifest else 0
 
-    for src_dir in source_directories:
-        png_subdir = os.path.join(src_dir, "png")
-        qa_subdir = os.path.join(src_dir, "json_qa")
-        annotations_subdir = os.path.join(src_dir, "json_annotations")
 
-        image_files = os.listdir(png_subdir)
+def combine_figure_data(
+        destination_directory,
+        source_directories,
+        stop_index=-1,
+        transfer_mode="copy",
+        n_threads=8,
+        output_format="json",
+        shard_size=256 * 1024 * 1024,
+        append=False,
+        profile_dir=None,
+        profile_every=1
+    ):
+    """
+    Combines the figures of SOURCE_DIRECTORIES into a split in DESTINATION_DIRECTORY. With APPEND, they are
+    added after the figures of a previous run, whose output is extended in place rather than rewritten.
+    """
 
-        for image in tqdm(iter(image_files), total=len(image_files), desc="Processing %s" % src_dir):
+    if not os.path.exists(destination_directory):
+        os.mkdir(destination_directory)
 
-            image_name = os.path.basename(image).replace(".png", "")
+    split_writer, dest_png_dir, first_image_index = _open_split_writer(destination_directory, output_format,
+                                                                       shard_size, append)
 
-            orig_image_index = int(re.match(r'^[0-9]+', image_name).group(0))
+    if first_image_index > 0:
+        logging.info("Appending after %d images" % first_image_index)
 
-            if stop_index >= 0 and orig_image_index >= stop_index:
-                break
+    # Image indices are assigned up front, in order of source directory then figure id
+    tasks = []
+    for src_dir in source_directories:
+        for image_name in _list_figures(src_dir, stop_index):
+            tasks.append((src_dir, image_name, first_image_index + len(tasks), dest_png_dir, transfer_mode))
 
-            # Copy image to new location
-            shutil.copy(os.path.join(png_subdir, image), os.path.join(dest_png_dir, "%d.png" % image_index))
+    transfer_counts = Counter()
+    pool = ThreadPool(n_threads)
 
-            # Read annotations and append
-            with open(os.path.join(annotations_subdir, "%s_annotations.json" % image_name), 'r') as f:
-                annotations = json.load(f)
-                annotations['image_index'] = image_index
-                all_annotations.append(annotations)
+    profiler = create_profiler(profile_dir, "combine", profile_every)
+    profile = profiler.profile if profiler else null_profile
 
-            # Read QA pairs and append
-            with open(os.path.join(qa_subdir, "%s.json" % image_name), 'r') as f:
-                qa_data = json.load(f)
-                qas = qa_data['qa_pairs']
+    try:
+        for annotations, qa_data, transferred_mode, png_bytes in tqdm(_load_figures(pool, tasks, n_threads, profile),
+                                                                     total=len(tasks), desc="Combining figures"):
+            with profile(annotations['image_index']):
+                split_writer.write(annotations, qa_data, png_bytes)
 
-            if not total_distinct_questions and len(qas) > 0:
-                total_distinct_questions = qa_data['total_distinct_questions']
-                total_distinct_colors = qa_data['total_distinct_colors']
+            if transferred_mode:
+                transfer_counts[transferred_mode] += 1
 
-            for qa in qas:
-                del qa['image']
-                del qa['annotations']
-                qa['image_index'] = image_index
-                all_qas.append(qa)
+        split_writer.close()
 
-            image_index += 1
+    finally:
+        pool.close()
+        pool.join()
 
-    logging.info("Dumping qa_pairs json...")
-    with open(os.path.join(destination_directory, "qa_pairs.json"), 'w') as f:
-        json.dump({
-            'qa_pairs': all_qas,
-            'total_distinct_questions': total_distinct_questions,
-            'total_distinct_colors': total_distinct_colors
-        }, f)
+    if profiler:
+        profiler.save()
 
-    logging.info("Dumping annotations json...")
-    with open(os.path.join(destination_directory, "annotations.json"), 'w') as f:
-        json.dump(all_annotations, f)
+    if transfer_counts[transfer_mode] != sum(transfer_counts.values()):
+        logging.warning("Could not %s all images: %s" % (transfer_mode, dict(transfer_counts)))
 
     logging.info("Done combining data.")
 
@@ -90,6 +293,20 @@ def combine_figure_data(
 @click.argument("source_directories", nargs=-1, required=True)
 @click.option("-x", "--stop-index", default=-1, type=int,
                 help="which image index to stop at in each directory of SOURCE_DIRECTORIES")
+@click.option("-t", "--transfer-mode", default="copy", type=click.Choice(TRANSFER_MODES),
+                help="how images are put in DESTINATION_DIRECTORY. 'rename' moves them out of SOURCE_DIRECTORIES")
+@click.option("-j", "--n-threads", default=8, type=int,
+                help="number of threads reading and transferring files")
+@click.option("-f", "--output-format", default="json", type=click.Choice(["json", "shards"]),
+                help="'json' for png/, qa_pairs.json, and annotations.json, or 'shards' for indexed record shards")
+@click.option("--shard-size", default=256 * 1024 * 1024, type=int,
+                help="approximate size in bytes of each shard with '--output-format shards'")
+@click.option("-a", "--append", flag_value=True,
+                help="add to the figures already combined in DESTINATION_DIRECTORY instead of replacing them")
+@click.option("--profile", "profile_dir", default=None,
+                help="directory to write cProfile stats and collapsed stacks of the loading threads and writer to")
+@click.option("--profile-every", default=1, type=int,
+                help="with '--profile', only profile every Nth figure to keep the overhead low")
 def main(**kwargs):
     """
     Combines all the figures, questions & answers, and annotations across all SOURCE_DIRECTORIES, each generated
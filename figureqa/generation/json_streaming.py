@@ -0,0 +1,56 @@
+#!/usr/bin/python
+import json
+
+
+# Stand-in for a streamed array while the surrounding object is serialized
+_PLACEHOLDER = "__streamed_json_array__"
+
+
+def split_json_object(obj, key):
+    """
+    Returns (head, tail) such that head + json.dumps(obj[key]) + tail == json.dumps(obj), so that
+    obj[key] can be streamed while keeping json.dump's key order and separators.
+    """
+    placeholder_obj = dict(obj)
+    placeholder_obj[key] = _PLACEHOLDER
+
+    head, tail = json.dumps(placeholder_obj).split(json.dumps(_PLACEHOLDER))
+    return head, tail
+
+
+class JSONArrayWriter (object):
+    """
+    Writes a JSON array to an open file one item at a time. The output is byte for byte what
+    json.dump would write for the whole list, optionally wrapped in HEAD and the tail given to 'close'.
+    """
+
+    def __init__(self, f, head=""):
+        self.f = f
+        self.count = 0
+        self.end = None
+
+        if head is not None:
+            self.f.write(head + "[")
+
+    @classmethod
+    def resume(cls, f, count):
+        """ Continues an array of COUNT items whose closing ']' F was truncated at. """
+        writer = cls(f, head=None)
+        writer.count = count
+        return writer
+
+    def write(self, item):
+        self.write_json(json.dumps(item))
+
+    def write_json(self, text):
+        """ Writes an item that is already serialized. """
+        if self.count > 0:
+            self.f.write(", ")
+
+        self.f.write(text)
+        self.count += 1
+
+    def close(self, tail=""):
+        # Byte offset of the closing ']', where the array can be resumed
+        self.end = self.f.tell()
+        self.f.write("]" + tail)
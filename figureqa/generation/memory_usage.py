@@ -0,0 +1,215 @@
+#!/usr/bin/python
+from __future__ import division
+
+import logging
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Process names of the web drivers' browsers, whose memory is reported separately
+BROWSER_PROCESS_NAMES = ["phantomjs"]
+
+# Allocations are snapshot again whenever the traced memory grows by this fraction
+SNAPSHOT_GROWTH = 0.1
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _read_processes():
+    """ Returns {pid: (name, parent pid, RSS in bytes)} of all processes, or None without /proc. """
+    if not os.path.isdir("/proc"):
+        return None
+
+    processes = {}
+
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+
+        try:
+            with open(os.path.join("/proc", pid, "stat"), 'r') as f:
+                stat = f.read()
+        except (IOError, OSError):
+            continue  # Exited since listing
+
+        # The name is in parentheses and may contain spaces
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2:].split()
+        processes[int(pid)] = (name, int(fields[1]), int(fields[21]) * PAGE_SIZE)
+
+    return processes
+
+
+def _descendants(processes, pid):
+    children = {}
+    for child, (_, parent, _) in processes.items():
+        children.setdefault(parent, []).append(child)
+
+    descendants = []
+    pending = list(children.get(pid, []))
+
+    while pending:
+        child = pending.pop()
+        descendants.append(child)
+        pending.extend(children.get(child, []))
+
+    return descendants
+
+
+def max_rss_bytes(who="self"):
+    """ Returns the peak RSS over the lifetime of this process, or of the largest child waited for. """
+    if not resource:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN).ru_maxrss
+
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _format_frame(frame):
+    return "%s:%d" % (frame.filename, frame.lineno)
+
+
+class MemoryMonitor (object):
+    """
+    Records the peak RSS of this process, of all its child processes (render workers and browsers),
+    and of the browsers alone, while each stage runs, by sampling /proc every INTERVAL seconds. With
+    TRACE_TOP, the TRACE_TOP lines that had the most memory allocated around each stage's peak are
+    recorded too, with tracemalloc, which slows allocations down considerably. ON_CHANGE is called as
+    each stage starts and ends, e.g. to save the report before a stage that may be killed for memory.
+    """
+
+    def __init__(self, interval=0.25, trace_top=0, on_change=None):
+        self.interval = interval
+        self.trace_top = trace_top
+        self.on_change = on_change
+        self.stages = []
+        self.current_stage = None
+
+        if trace_top and not tracemalloc:
+            logging.warning("tracemalloc needs Python 3.4 or newer, not recording allocations")
+            self.trace_top = 0
+
+    def _sample(self, peaks):
+        processes = _read_processes()
+
+        if processes is None:
+            return
+
+        pid = os.getpid()
+        descendants = _descendants(processes, pid)
+        rss = {
+            'peak_rss_bytes': processes[pid][2] if pid in processes else 0,
+            'peak_children_rss_bytes': sum(processes[child][2] for child in descendants),
+            'peak_browser_rss_bytes': sum(processes[child][2] for child in descendants
+                                          if processes[child][0] in BROWSER_PROCESS_NAMES)
+        }
+
+        for key, value in rss.items():
+            peaks[key] = max(peaks.get(key, 0), value)
+
+    def _snapshot_if_grown(self, state):
+        traced, _ = tracemalloc.get_traced_memory()
+
+        if state['snapshot'] is None or traced > state['snapshot_size'] * (1 + SNAPSHOT_GROWTH):
+            state['snapshot'] = tracemalloc.take_snapshot()
+            state['snapshot_size'] = traced
+
+    def _run_sampler(self, peaks, state, stop):
+        while not stop.wait(self.interval):
+            self._sample(peaks)
+
+            if self.trace_top:
+                self._snapshot_if_grown(state)
+
+    def _top_allocations(self, snapshot):
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+
+        return [{'location': _format_frame(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:self.trace_top]]
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """ Monitors the memory used by the code inside, saving it as a stage with NAME and LABELS. """
+        peaks = {}
+        state = {'snapshot': None, 'snapshot_size': 0}
+
+        started_tracing = False
+        if self.trace_top:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+
+            tracemalloc.clear_traces()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+
+        self._sample(peaks)
+
+        self.current_stage = dict(labels, stage=name)
+        if self.on_change:
+            self.on_change()
+
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._run_sampler, args=(peaks, state, stop))
+        sampler.daemon = True
+        sampler.start()
+
+        start_time = time.time()
+
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+
+            self._sample(peaks)
+
+            record = {'stage': name, 'seconds': time.time() - start_time}
+            record.update(labels)
+            record.update(peaks)
+
+            if self.trace_top:
+                self._snapshot_if_grown(state)
+                record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                record['top_allocations'] = self._top_allocations(state['snapshot'])
+
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self.stages.append(record)
+            self.current_stage = None
+
+            logging.info("Memory of %s: peak RSS %.1f MB, children %.1f MB, browsers %.1f MB" % (
+                name, peaks.get('peak_rss_bytes', 0) / 2**20, peaks.get('peak_children_rss_bytes', 0) / 2**20,
+                peaks.get('peak_browser_rss_bytes', 0) / 2**20))
+
+            if self.on_change:
+                self.on_change()
+
+    def report(self):
+        return {
+            'max_rss_bytes': max_rss_bytes(),
+            'max_children_rss_bytes': max_rss_bytes("children"),
+            'stages': self.stages,
+            'current_stage': self.current_stage
+        }
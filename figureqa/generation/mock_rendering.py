@@ -0,0 +1,257 @@
+#!/usr/bin/python
+from __future__ import division
+
+import struct
+import zlib
+
+
+# Layout of the fake plot area inside the figure, in pixels
+MARGIN_LEFT = 60
+MARGIN_RIGHT = 20
+MARGIN_TOP = 40
+MARGIN_BOTTOM = 60
+
+N_MAJOR_TICKS = 5
+N_MINOR_PER_MAJOR = 4
+
+LEGEND_ITEM_HEIGHT = 20
+LEGEND_ITEM_WIDTH = 100
+
+_png_cache = {}
+
+
+def _bbox(x, y, w, h):
+    return {'x': int(x), 'y': int(y), 'w': int(max(w, 1)), 'h': int(max(h, 1))}
+
+
+def placeholder_png(width, height):
+    """ Encodes a blank white RGBA image of the given size, caching the bytes per size. """
+    key = (width, height)
+
+    if key not in _png_cache:
+        def chunk(tag, data):
+            body = tag + data
+            return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+        raw = (b"\x00" + b"\xff" * (4 * width)) * height
+        _png_cache[key] = b"".join([
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(raw, 1)),
+            chunk(b"IEND", b"")
+        ])
+
+    return _png_cache[key]
+
+
+class _Canvas (object):
+    """ Maps data coordinates onto the fake plot area. """
+
+    def __init__(self, width, height, x_range, y_range):
+        self.width = width
+        self.height = height
+        self.left = MARGIN_LEFT
+        self.top = MARGIN_TOP
+        self.plot_w = max(width - MARGIN_LEFT - MARGIN_RIGHT, 1)
+        self.plot_h = max(height - MARGIN_TOP - MARGIN_BOTTOM, 1)
+        self.x_range = x_range if x_range[1] != x_range[0] else (x_range[0], x_range[0] + 1)
+        self.y_range = y_range if y_range[1] != y_range[0] else (y_range[0], y_range[0] + 1)
+
+    def px(self, x):
+        return self.left + self.plot_w * (x - self.x_range[0]) / (self.x_range[1] - self.x_range[0])
+
+    def py(self, y):
+        return self.top + self.plot_h * (1 - (y - self.y_range[0]) / (self.y_range[1] - self.y_range[0]))
+
+
+def _axis(canvas, dimension, categories=None):
+    lo, hi = canvas.x_range if dimension == 0 else canvas.y_range
+
+    if categories:
+        values = list(categories)
+        positions = [lo + (hi - lo) * (i + 0.5) / len(values) for i in range(len(values))]
+        minor = []
+    else:
+        positions = [lo + (hi - lo) * i / (N_MAJOR_TICKS - 1) for i in range(N_MAJOR_TICKS)]
+        values = positions
+        step = (hi - lo) / ((N_MAJOR_TICKS - 1) * (N_MINOR_PER_MAJOR + 1))
+        minor = [lo + step * i for i in range((N_MAJOR_TICKS - 1) * (N_MINOR_PER_MAJOR + 1) + 1)]
+
+    if dimension == 0:
+        axis_y = canvas.top + canvas.plot_h
+        tick = lambda v: _bbox(canvas.px(v), axis_y, 1, 6)
+        tick_label = lambda v: _bbox(canvas.px(v) - 15, axis_y + 8, 30, 12)
+        rule = _bbox(canvas.left, axis_y, canvas.plot_w, 1)
+        label = _bbox(canvas.left + canvas.plot_w / 2 - 40, canvas.height - 25, 80, 14)
+        text = "xaxis_label"
+    else:
+        tick = lambda v: _bbox(canvas.left - 6, canvas.py(v), 6, 1)
+        tick_label = lambda v: _bbox(canvas.left - 40, canvas.py(v) - 6, 32, 12)
+        rule = _bbox(canvas.left, canvas.top, 1, canvas.plot_h)
+        label = _bbox(5, canvas.top + canvas.plot_h / 2 - 40, 14, 80)
+        text = "yaxis_label"
+
+    return {
+        'major_ticks': [{'bbox': tick(p), 'value': v} for p, v in zip(positions, values)],
+        'major_labels': [{'bbox': tick_label(p), 'text': str(v)} for p, v in zip(positions, values)],
+        'minor_ticks': [{'bbox': tick(p), 'value': p} for p in minor],
+        'rule': [{'bbox': rule}],
+        'label': [{'bbox': label, 'text': text}]
+    }
+
+
+def _gridlines(canvas, dimension):
+    axis = _axis(canvas, dimension)
+    gridlines = []
+
+    for major in axis['major_ticks']:
+        if dimension == 0:
+            bbox = _bbox(major['bbox']['x'], canvas.top, 1, canvas.plot_h)
+        else:
+            bbox = _bbox(canvas.left, major['bbox']['y'], canvas.plot_w, 1)
+        gridlines.append({'bbox': bbox, 'value': major['value']})
+
+    return {'gridlines': gridlines}
+
+
+def _legend(canvas, labels):
+    x = canvas.left + canvas.plot_w - LEGEND_ITEM_WIDTH - 10
+    y = canvas.top + 10
+
+    items = []
+    for i, label in enumerate(labels):
+        item_y = y + i * LEGEND_ITEM_HEIGHT
+        items.append({
+            'model': label,
+            'label': {'bbox': _bbox(x + 25, item_y + 3, LEGEND_ITEM_WIDTH - 30, 14), 'text': label},
+            'preview': {'bbox': _bbox(x + 5, item_y + 3, 15, 14)}
+        })
+
+    return {'bbox': _bbox(x, y, LEGEND_ITEM_WIDTH, LEGEND_ITEM_HEIGHT * len(labels)), 'items': items}
+
+
+def _bar_data(source, rendered_data):
+    bars = source['data'][0]
+    horizontal = source['type'] == 'hbar_categorical'
+    categories = bars['y'] if horizontal else bars['x']
+    values = bars['x'] if horizontal else bars['y']
+
+    value_range = (0, max(max(values), 1))
+    cat_range = (0, len(categories))
+
+    if horizontal:
+        canvas = _Canvas(rendered_data['_figure_info']['w'], rendered_data['_figure_info']['h'], value_range, cat_range)
+    else:
+        canvas = _Canvas(rendered_data['_figure_info']['w'], rendered_data['_figure_info']['h'], cat_range, value_range)
+
+    rendered_bars = []
+    for i, value in enumerate(values):
+        if horizontal:
+            top = canvas.py(i + 0.75)
+            height = canvas.py(i + 0.25) - top
+            rendered_bars.append({'bbox': _bbox(canvas.px(0), top, canvas.px(value) - canvas.px(0), height),
+                                  'height': 0.5})
+        else:
+            left = canvas.px(i + 0.25)
+            rendered_bars.append({'bbox': _bbox(left, canvas.py(value), canvas.px(i + 0.75) - left,
+                                                canvas.py(0) - canvas.py(value)),
+                                  'width': 0.5})
+
+    rendered_data['the_bars'] = {'bars': rendered_bars}
+    rendered_data['the_xaxis'] = _axis(canvas, 0, None if horizontal else categories)
+    rendered_data['the_yaxis'] = _axis(canvas, 1, categories if horizontal else None)
+
+    return canvas
+
+
+def _line_data(source, rendered_data):
+    point_sets = source['data']
+    all_x = [x for ps in point_sets for x in ps['x']]
+    all_y = [y for ps in point_sets for y in ps['y']]
+
+    canvas = _Canvas(rendered_data['_figure_info']['w'], rendered_data['_figure_info']['h'],
+                     (min(all_x), max(all_x)), (min(all_y), max(all_y)))
+
+    for ps in point_sets:
+        points = [(canvas.px(x), canvas.py(y)) for x, y in zip(ps['x'], ps['y'])]
+
+        if source['type'] == 'dot_line':
+            rendered_data[ps['label']] = {'points': [{'bbox': _bbox(x - 5, y - 5, 10, 10)} for x, y in points]}
+        else:
+            segments = []
+            for (x0, y0), (x1, y1) in zip(points[:-1], points[1:]):
+                segments.append({'bbox': _bbox(min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0))})
+            rendered_data[ps['label']] = {'segments': segments}
+
+    rendered_data['the_xaxis'] = _axis(canvas, 0)
+    rendered_data['the_yaxis'] = _axis(canvas, 1)
+
+    return canvas
+
+
+def _pie_data(source, rendered_data):
+    wedges = source['data'][0]
+    canvas = _Canvas(rendered_data['_figure_info']['w'], rendered_data['_figure_info']['h'], (-1, 1), (-1, 1))
+
+    radius = min(canvas.plot_w, canvas.plot_h) / 2
+    cx, cy = canvas.px(0), canvas.py(0)
+    pie_bbox = _bbox(cx - radius, cy - radius, 2 * radius, 2 * radius)
+
+    for label in wedges['labels']:
+        rendered_data[label] = {'slices': [{'bbox': pie_bbox}]}
+
+    if not source['visuals'].get('draw_legend'):
+        rendered_data['the_pie_labels'] = {
+            'labels': [{'text': label, 'bbox': _bbox(canvas.px(x) - 30, canvas.py(y) - 6, 60, 12)}
+                       for label, x, y in zip(wedges['labels'], wedges['label_x'], wedges['label_y'])]
+        }
+
+    return canvas
+
+
+def mock_rendered_data(source):
+    """
+    Builds rendered data in the structure returned by the BokehJS export for SOURCE, with plausible
+    but synthetic bounding boxes.
+    """
+    visuals = source['visuals']
+    rendered_data = {'_figure_info': {'w': visuals['figure_width'], 'h': visuals['figure_height']}}
+
+    if source['type'] in ['vbar_categorical', 'hbar_categorical']:
+        canvas = _bar_data(source, rendered_data)
+        legend_labels = []
+    elif source['type'] in ['line', 'dot_line']:
+        canvas = _line_data(source, rendered_data)
+        legend_labels = [ps['label'] for ps in source['data']]
+    else:
+        canvas = _pie_data(source, rendered_data)
+        legend_labels = source['data'][0]['labels']
+
+    rendered_data['the_title'] = {'title': {'bbox': _bbox(canvas.width / 2 - 20, 10, 40, 16), 'text': "title"}}
+
+    if source['type'] != 'pie' and visuals.get('draw_gridlines'):
+        rendered_data['the_x_gridlines'] = _gridlines(canvas, 0)
+        rendered_data['the_y_gridlines'] = _gridlines(canvas, 1)
+
+    if visuals.get('draw_legend') and legend_labels:
+        rendered_data['the_legend'] = _legend(canvas, legend_labels)
+
+    return rendered_data
+
+
+class MockWebDriver (object):
+    """
+    Stand-in for the PhantomJS web driver that skips the browser entirely. Writes a blank PNG and
+    returns synthetic rendered data, so everything around rendering can be benchmarked without a browser.
+    """
+
+    def export_png_and_data(self, source, png_file, html_file=None):
+        rendered_data = mock_rendered_data(source)
+
+        with open(png_file, 'wb') as f:
+            f.write(placeholder_png(rendered_data['_figure_info']['w'], rendered_data['_figure_info']['h']))
+
+        return rendered_data
+
+    def quit(self):
+        pass
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+import cProfile
+import errno
+import os
+import pstats
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Paths through the call graph below this fraction of the total time are left out of collapsed stacks
+MIN_STACK_FRACTION = 1e-4
+
+
+def _frame_name(func):
+    filename, line, name = func
+
+    if filename == "~":
+        return name  # builtins
+    return "%s (%s:%d)" % (name, os.path.basename(filename), line)
+
+
+def collapsed_stacks(stats):
+    """
+    Returns the collapsed stacks ("outer;...;inner" to seconds) of a pstats.Stats. cProfile only records
+    caller-callee pairs, so a function's time is split across the paths to it in proportion to the
+    time of each of its callers.
+    """
+    stats = stats.stats
+    callees = defaultdict(list)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+
+    # Recursive functions called from the profiled code have only themselves as callers
+    roots = [func for func, entry in stats.items() if not set(entry[4]) - set([func])]
+    min_seconds = MIN_STACK_FRACTION * sum(stats[func][3] for func in roots)
+
+    stacks = defaultdict(float)
+    pending = [(func, (), (), stats[func][3]) for func in roots]
+
+    while pending:
+        func, path, path_funcs, seconds = pending.pop()
+        total_seconds = stats[func][3]
+        scale = seconds / total_seconds if total_seconds > 0 else 0.0
+
+        path = path + (_frame_name(func),)
+        path_funcs = path_funcs + (func,)
+        stacks[";".join(path)] += stats[func][2] * scale
+
+        for callee, edge_seconds in callees[func]:
+            # Recursion is folded into the outermost call
+            if callee not in path_funcs and edge_seconds * scale >= min_seconds:
+                pending.append((callee, path, path_funcs, edge_seconds * scale))
+
+    return stacks
+
+
+class StageProfiler (object):
+    """
+    Collects cProfile stats of one pipeline stage. Code runs profiled inside 'profile'; passing the index
+    of a figure profiles only every SAMPLE_EVERY-th one. Each thread gets its own profile, except on
+    Python 3.12 and up, where only one thread at a time is profiled. All are merged by 'save', which
+    writes <stage>.prof for pstats/snakeviz and <stage>.collapsed for flame graph tools, with stack
+    weights in microseconds.
+    """
+
+    def __init__(self, profile_dir, stage, sample_every=1):
+        self.profile_dir = profile_dir
+        self.stage = stage
+        self.sample_every = max(sample_every, 1)
+
+        self._local = threading.local()
+        self._profiles = []
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(profile_dir)
+        except OSError as e:
+            # Parallel render workers all create it
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextmanager
+    def profile(self, index=None):
+        if index is not None and index % self.sample_every != 0:
+            yield
+            return
+
+        profile = getattr(self._local, 'profile', None) or cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 and up only allow one active profiler at a time, so other threads go unprofiled
+            yield
+            return
+
+        # Only profiles that were enabled have stats to save
+        if not hasattr(self._local, 'profile'):
+            self._local.profile = profile
+            with self._lock:
+                self._profiles.append(profile)
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def save(self):
+        stats = None
+
+        for profile in self._profiles:
+            profile.create_stats()
+
+            if not profile.stats:
+                continue
+            elif stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+        if stats is None:
+            return
+
+        prefix = os.path.join(self.profile_dir, self.stage)
+        stats.dump_stats(prefix + ".prof")
+
+        with open(prefix + ".collapsed", 'w') as f:
+            for stack, seconds in sorted(collapsed_stacks(stats).items()):
+                if seconds >= 1e-6:
+                    f.write("%s %d\n" % (stack, int(round(seconds * 1e6))))
+
+
+@contextmanager
+def null_profile(index=None):
+    yield
+
+
+def create_profiler(profile_dir, stage, sample_every=1):
+    """ Returns a StageProfiler, or None if PROFILE_DIR is None. """
+    return StageProfiler(profile_dir, stage, sample_every) if profile_dir else None
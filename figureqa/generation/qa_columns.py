@@ -0,0 +1,111 @@
+#!/usr/bin/python
+import click
+import logging
+import os
+import re
+
+import numpy as np
+from tqdm import tqdm
+
+from data_utils import read_color_map
+from questions.categorical import QUESTION_TEMPLATES as CATEGORICAL_TEMPLATES
+from questions.lines import QUESTION_TEMPLATES as LINE_TEMPLATES
+from split_reader import find_qa_pairs_array, iter_json_array
+
+
+PAD_TOKEN = "<pad>"
+UNKNOWN_TOKEN = "<unk>"
+
+_TOKEN = re.compile(r"[\w']+|[^\w\s]")
+
+
+def tokenize(question_string):
+    """ Splits a question into lowercase words and punctuation. """
+    return _TOKEN.findall(question_string.lower())
+
+
+def build_vocabulary(colors):
+    """
+    Builds the token vocabulary of all questions that can be generated with the COLORS file, from the
+    question templates and the color names. Token id 0 is padding and 1 is for unknown tokens.
+    """
+    tokens = set()
+
+    for template in list(CATEGORICAL_TEMPLATES.values()) + list(LINE_TEMPLATES.values()):
+        tokens.update(tokenize(template.replace("%s", " ")))
+
+    for name in read_color_map(colors):
+        tokens.update(tokenize(name))
+
+    return [PAD_TOKEN, UNKNOWN_TOKEN] + sorted(tokens)
+
+
+def export_qa_columns(
+        qa_pairs_json,
+        output_file_npz=None,
+        colors=os.path.join("resources", "x11_colors_refined.txt")
+    ):
+    """
+    Writes the QA pairs of a combined qa_pairs.json as NumPy columns: image_index, question_id, answer,
+    color1_id, color2_id, and the question strings as a padded token id matrix with their lengths.
+    """
+    output_file_npz = output_file_npz if output_file_npz else os.path.splitext(qa_pairs_json)[0] + ".npz"
+
+    vocabulary = build_vocabulary(colors)
+    token_ids = dict((token, i) for i, token in enumerate(vocabulary))
+    unknown_id = token_ids[UNKNOWN_TOKEN]
+
+    columns = dict((key, []) for key in ['image_index', 'question_id', 'answer', 'color1_id', 'color2_id'])
+    questions = []
+    n_unknown = 0
+
+    with open(qa_pairs_json, 'rb') as f:
+        for _, _, qa in tqdm(iter_json_array(f, find_qa_pairs_array(f)), desc="Reading QA pairs"):
+            for key in columns:
+                columns[key].append(qa[key])
+
+            question = [token_ids.get(token, unknown_id) for token in tokenize(qa['question_string'])]
+            n_unknown += question.count(unknown_id)
+            questions.append(question)
+
+    if n_unknown:
+        logging.warning("%d question tokens are not in the vocabulary, is '%s' the right colors file?" % (n_unknown, colors))
+
+    lengths = np.array([len(q) for q in questions], dtype=np.int16)
+    tokens = np.zeros((len(questions), lengths.max() if len(questions) else 0), dtype=np.int16)
+    for i, question in enumerate(questions):
+        tokens[i, :len(question)] = question
+
+    np.savez(output_file_npz,
+             image_index=np.array(columns['image_index'], dtype=np.int32),
+             question_id=np.array(columns['question_id'], dtype=np.int8),
+             answer=np.array(columns['answer'], dtype=np.int8),
+             color1_id=np.array(columns['color1_id'], dtype=np.int16),
+             color2_id=np.array(columns['color2_id'], dtype=np.int16),
+             tokens=tokens,
+             token_length=lengths,
+             vocabulary=np.array(vocabulary))
+
+
+def load_qa_columns(qa_columns_npz):
+    """ Loads every column written by 'export_qa_columns' into a dict of arrays. """
+    with np.load(qa_columns_npz) as stored:
+        return dict((key, stored[key]) for key in stored.files)
+
+
+@click.command()
+@click.argument("qa_pairs_json")
+@click.option("-o", "--output-file-npz", default=None,
+                help="where to write the columns, defaults to QA_PAIRS_JSON with an .npz extension")
+@click.option("--colors", default=os.path.join("resources", "x11_colors_refined.txt"),
+                help="colors file the data was generated with, for the vocabulary")
+def main(**kwargs):
+    """
+    Exports QA_PAIRS_JSON, produced by 'json_combiner.py', as NumPy columns with pretokenized questions.
+    """
+    logging.basicConfig(level=logging.INFO)
+    export_qa_columns(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
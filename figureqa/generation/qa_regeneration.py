@@ -0,0 +1,114 @@
+#!/usr/bin/python
+import click
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import random
+
+from tqdm import tqdm
+
+from data_utils import read_color_map
+from questions.categorical import generate_bar_graph_questions, generate_pie_chart_questions
+from questions.lines import generate_line_plot_questions
+from questions.utils import balance_questions_by_qid, NUM_DISTINCT_QS
+
+
+QUESTION_GENERATORS = {
+    'vbar_categorical': generate_bar_graph_questions,
+    'hbar_categorical': generate_bar_graph_questions,
+    'pie': generate_pie_chart_questions,
+    'line': generate_line_plot_questions,
+    'dot_line': generate_line_plot_questions
+}
+
+
+def _init_worker(color_map, seed):
+    global worker_color_map
+    global worker_seed
+    worker_color_map = color_map
+    worker_seed = seed
+
+
+def _generate_questions(annotations):
+    # Seed per figure so the result doesn't depend on how figures are spread over workers
+    np.random.seed(worker_seed + annotations['image_index'])
+    random.seed(worker_seed + annotations['image_index'])
+
+    qa_pairs = QUESTION_GENERATORS[annotations['type']](annotations, color_map=worker_color_map)
+
+    return {'image_index': annotations['image_index'], 'qa_pairs': qa_pairs}
+
+
+def regenerate_qa_pairs(
+        split_directory,
+        output_file_json=None,
+        colors=os.path.join("resources", "x11_colors_refined.txt"),
+        seed=1,
+        keep_all_questions=False,
+        n_workers=None
+    ):
+    """
+    Reruns question generation on the annotations of a split combined with 'json_combiner.py' and
+    writes a new qa_pairs.json, without rendering any figures.
+    """
+    output_file_json = output_file_json if output_file_json else os.path.join(split_directory, "qa_pairs.json")
+    color_map = read_color_map(colors)
+
+    logging.info("Loading annotations...")
+    with open(os.path.join(split_directory, "annotations.json"), 'r') as f:
+        all_annotations = json.load(f)
+
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(color_map, seed))
+
+    try:
+        chunksize = max(1, len(all_annotations) // (64 * (n_workers or multiprocessing.cpu_count())))
+        generated_data = list(tqdm(pool.imap(_generate_questions, all_annotations, chunksize),
+                                   total=len(all_annotations), desc="Generating questions"))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Balance by question ID
+    if not keep_all_questions:
+        balance_questions_by_qid(generated_data)
+
+    all_qas = []
+    for data in generated_data:
+        for qa in data['qa_pairs']:
+            qa['image_index'] = data['image_index']
+            all_qas.append(qa)
+
+    logging.info("Dumping qa_pairs json...")
+    with open(output_file_json, 'w') as f:
+        json.dump({
+            'qa_pairs': all_qas,
+            'total_distinct_questions': NUM_DISTINCT_QS,
+            'total_distinct_colors': len(color_map)
+        }, f)
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--output-file-json", default=None,
+                help="where to write the new QA pairs, defaults to qa_pairs.json in SPLIT_DIRECTORY")
+@click.option("--colors", default=os.path.join("resources", "x11_colors_refined.txt"),
+                help="file with all color names and hexcodes")
+@click.option("--seed", default=1, type=int,
+                help="seed for PRNGs")
+@click.option("--keep-all-questions", flag_value=True,
+                help="if specified, all possible questions will be kept without any filtering")
+@click.option("-w", "--n-workers", default=None, type=int,
+                help="number of worker processes, defaults to the number of CPUs")
+def main(**kwargs):
+    """
+    Regenerates the question-answer pairs of SPLIT_DIRECTORY, produced by 'json_combiner.py', from its
+    annotations.json.
+    """
+    logging.basicConfig(level=logging.INFO)
+    regenerate_qa_pairs(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,17 @@ from collections import Counter
 from utils import augment_questions
 
 
+# Question string of each question id
+QUESTION_TEMPLATES = {
+    0: "Is %s the minimum?",
+    1: "Is %s the maximum?",
+    2: "Is %s less than %s?",
+    3: "Is %s greater than %s?",
+    4: "Is %s the low median?",
+    5: "Is %s the high median?"
+}
+
+
 def _get_cat_noncat_bars(bars_data):
     """ Returns (cat, non-cat) """
     if type(bars_data['x'][0]) == type("") or type(bars_data['x'][0]) == type(u""):
@@ -29,12 +40,12 @@ def _generate(original_data, cat, noncat, color_map=None):
     max_category = sorted_categories[-1]
 
     qa_pairs += [{
-                    'question_string': "Is %s the minimum?" % min_category[0], 'question_id': 0,
+                    'question_string': QUESTION_TEMPLATES[0] % min_category[0], 'question_id': 0,
                     'color1_name': min_category[0], 'color2_name': "--None--",
                     'answer': 1
                 },
                 {
-                    'question_string': "Is %s the maximum?" % max_category[0], 'question_id': 1,
+                    'question_string': QUESTION_TEMPLATES[1] % max_category[0], 'question_id': 1,
                     'color1_name': max_category[0], 'color2_name': "--None--",
                     'answer': 1
                 }]
@@ -65,46 +76,46 @@ def _generate(original_data, cat, noncat, color_map=None):
 
         if not_min_category:
             qa_pairs.append({
-                                'question_string': "Is %s the minimum?" % not_min_category, 'question_id': 0,
+                                'question_string': QUESTION_TEMPLATES[0] % not_min_category, 'question_id': 0,
                                 'color1_name': not_min_category, 'color2_name': "--None--",
                                 'answer': 0
                             })
 
         if not_max_category:
             qa_pairs.append({
-                                'question_string': "Is %s the maximum?" % not_max_category, 'question_id': 1,
+                                'question_string': QUESTION_TEMPLATES[1] % not_max_category, 'question_id': 1,
                                 'color1_name': not_max_category, 'color2_name': "--None--",
                                 'answer': 0
                             })
         
         if less and greater:
             qa_pairs += [{
-                            'question_string': "Is %s greater than %s?" % (greater, less), 'question_id': 3,
+                            'question_string': QUESTION_TEMPLATES[3] % (greater, less), 'question_id': 3,
                             'color1_name': greater, 'color2_name': less,
                             'answer': 1
                         },
                         {
-                            'question_string': "Is %s less than %s?" % (less, greater), 'question_id': 2,
+                            'question_string': QUESTION_TEMPLATES[2] % (less, greater), 'question_id': 2,
                             'color1_name': less, 'color2_name': greater,
                             'answer': 1},
                         {
-                            'question_string': "Is %s greater than %s?" % (less, greater), 'question_id': 3,
+                            'question_string': QUESTION_TEMPLATES[3] % (less, greater), 'question_id': 3,
                             'color1_name': less, 'color2_name': greater,
                             'answer': 0},
                         {
-                            'question_string': "Is %s less than %s?" % (greater, less), 'question_id': 2,
+                            'question_string': QUESTION_TEMPLATES[2] % (greater, less), 'question_id': 2,
                             'color1_name': greater, 'color2_name': less,
                             'answer': 0
                         }]
 
     else:
         qa_pairs += [{
-                        'question_string': "Is %s greater than %s?" % (min_category, max_category), 'question_id': 3,
+                        'question_string': QUESTION_TEMPLATES[3] % (min_category, max_category), 'question_id': 3,
                         'color1_name': min_category, 'color2_name': max_category,
                         'answer': 0
                     },
                     {
-                        'question_string': "Is %s less than %s?" % (max_category, min_category), 'question_id': 2,
+                        'question_string': QUESTION_TEMPLATES[2] % (max_category, min_category), 'question_id': 2,
                         'color1_name': max_category, 'color2_name': min_category,
                         'answer': 0
                     }]
@@ -126,22 +137,22 @@ def _generate(original_data, cat, noncat, color_map=None):
                         + range(median_high_index + 1, len(sorted_categories) ))][0]
 
     qa_pairs += [{
-                    'question_string': "Is %s the high median?" % median_high, 'question_id': 5,
+                    'question_string': QUESTION_TEMPLATES[5] % median_high, 'question_id': 5,
                     'color1_name': median_high, 'color2_name': "--None--",
                     'answer': 1
                 },
                 {
-                    'question_string': "Is %s the low median?" % median_low, 'question_id': 4,
+                    'question_string': QUESTION_TEMPLATES[4] % median_low, 'question_id': 4,
                     'color1_name': median_low, 'color2_name': "--None--",
                     'answer': 1
                 },
                 {
-                    'question_string': "Is %s the high median?" % not_median_high, 'question_id': 5,
+                    'question_string': QUESTION_TEMPLATES[5] % not_median_high, 'question_id': 5,
                     'color1_name': not_median_high, 'color2_name': "--None--",
                     'answer': 0
                 },
                 {
-                    'question_string': "Is %s the low median?" % not_median_low, 'question_id': 4,
+                    'question_string': QUESTION_TEMPLATES[4] % not_median_low, 'question_id': 4,
                     'color1_name': not_median_low, 'color2_name': "--None--",
                     'answer': 0
                 }]
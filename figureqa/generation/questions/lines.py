@@ -7,6 +7,20 @@ from sklearn.metrics import auc
 
 from utils import augment_questions
 
+
+# Question string of each question id
+QUESTION_TEMPLATES = {
+    6: "Does %s have the minimum area under the curve?",
+    7: "Does %s have the maximum area under the curve?",
+    8: "Is %s the smoothest?",
+    9: "Is %s the roughest?",
+    10: "Does %s have the lowest value?",
+    11: "Does %s have the highest value?",
+    12: "Is %s less than %s?",
+    13: "Is %s greater than %s?",
+    14: "Does %s intersect %s?"
+}
+
 def _calculate_roughness(x, y):
 
     x = np.array(x)
@@ -79,25 +93,25 @@ def generate_line_plot_questions(data, color_map=None):
     # Generate AUC Qs
     auc_q_data = _get_min_max_non(aucs.items())
     qa_pairs += [{
-                    'question_string': "Does %s have the minimum area under the curve?" % auc_q_data['min'], 
+                    'question_string': QUESTION_TEMPLATES[6] % auc_q_data['min'], 
                     'question_id': 6, 'color1_name': auc_q_data['min'], 'color2_name': "--None--",
                     'answer': 1
                 },
                 {
-                    'question_string': "Does %s have the maximum area under the curve?" % auc_q_data['max'],
+                    'question_string': QUESTION_TEMPLATES[7] % auc_q_data['max'],
                     'question_id': 7, 'color1_name': auc_q_data['max'], 'color2_name': "--None--",
                     'answer': 1
                 }]
 
     if 'not_min' in auc_q_data:
         qa_pairs.append({   
-                            'question_string': "Does %s have the minimum area under the curve?" % auc_q_data['not_min'],
+                            'question_string': QUESTION_TEMPLATES[6] % auc_q_data['not_min'],
                             'question_id': 6, 'color1_name': auc_q_data['not_min'], 'color2_name': "--None--", 
                             'answer': 0
                         })
     if 'not_max' in auc_q_data:
         qa_pairs.append({
-                            'question_string': "Does %s have the maximum area under the curve?" % auc_q_data['not_max'],
+                            'question_string': QUESTION_TEMPLATES[7] % auc_q_data['not_max'],
                             'question_id': 7, 'color1_name': auc_q_data['not_max'], 'color2_name': "--None--",
                             'answer': 0
                         })
@@ -105,26 +119,26 @@ def generate_line_plot_questions(data, color_map=None):
     # Generate smoothness Qs
     roughness_q_data = _get_min_max_non(roughnesses.items())
     qa_pairs += [{
-                    'question_string': "Is %s the smoothest?" % roughness_q_data['min'], 'question_id': 8, 
+                    'question_string': QUESTION_TEMPLATES[8] % roughness_q_data['min'], 'question_id': 8, 
                     'color1_name': roughness_q_data['min'], 'color2_name': "--None--",
                     'answer': 1
                 },
                 {
-                    'question_string': "Is %s the roughest?" % roughness_q_data['max'], 'question_id': 9, 
+                    'question_string': QUESTION_TEMPLATES[9] % roughness_q_data['max'], 'question_id': 9, 
                     'color1_name': roughness_q_data['max'], 'color2_name': "--None--",
                     'answer': 1
                 }]
 
     if 'not_min' in roughness_q_data:
         qa_pairs.append({
-                            'question_string': "Is %s the smoothest?" % roughness_q_data['not_min'], 'question_id': 8,
+                            'question_string': QUESTION_TEMPLATES[8] % roughness_q_data['not_min'], 'question_id': 8,
                             'color1_name': roughness_q_data['not_min'], 'color2_name': "--None--", 
                             'answer': 0
                         })
 
     if 'not_max' in roughness_q_data:
         qa_pairs.append({
-                            'question_string': "Is %s the roughest?" % roughness_q_data['not_max'], 'question_id': 9,
+                            'question_string': QUESTION_TEMPLATES[9] % roughness_q_data['not_max'], 'question_id': 9,
                             'color1_name': roughness_q_data['not_max'], 'color2_name': "--None--",
                             'answer': 0
                         })
@@ -132,28 +146,28 @@ def generate_line_plot_questions(data, color_map=None):
     # Generate questions for absolute max and min
     global_min_data = _get_min_max_non(global_mins.items())
     qa_pairs.append({
-                        'question_string': "Does %s have the lowest value?" % global_min_data['min'], 'question_id': 10,
+                        'question_string': QUESTION_TEMPLATES[10] % global_min_data['min'], 'question_id': 10,
                         'color1_name': global_min_data['min'], 'color2_name': "--None--", 
                         'answer': 1
                     })
 
     if 'not_min' in global_min_data:
         qa_pairs.append({
-                            'question_string': "Does %s have the lowest value?" % global_min_data['not_min'], 'question_id': 10,
+                            'question_string': QUESTION_TEMPLATES[10] % global_min_data['not_min'], 'question_id': 10,
                             'color1_name': global_min_data['not_min'], 'color2_name': "--None--",
                             'answer': 0
                         })
 
     global_max_data = _get_min_max_non(global_maxes.items())
     qa_pairs.append({
-                        'question_string': "Does %s have the highest value?" % global_max_data['max'], 'question_id': 11,
+                        'question_string': QUESTION_TEMPLATES[11] % global_max_data['max'], 'question_id': 11,
                         'color1_name': global_max_data['max'], 'color2_name': "--None--",
                         'answer': 1
                     })
 
     if 'not_max' in global_max_data:
         qa_pairs.append({
-                            'question_string': "Does %s have the highest value?" % global_max_data['not_max'], 'question_id': 11,
+                            'question_string': QUESTION_TEMPLATES[11] % global_max_data['not_max'], 'question_id': 11,
                             'color1_name': global_max_data['not_max'], 'color2_name': "--None--",
                             'answer': 0
                         })
@@ -201,42 +215,42 @@ def generate_line_plot_questions(data, color_map=None):
     # Generate some questions using this strictness data
     if strictness_map['AltB']:
         qa_pairs.append({
-                            'question_string': "Is %s less than %s?" % strictness_map['AltB'], 'question_id': 12,
+                            'question_string': QUESTION_TEMPLATES[12] % strictness_map['AltB'], 'question_id': 12,
                             'color1_name': strictness_map['AltB'][0], 'color2_name': strictness_map['AltB'][1],
                             'answer': 1
                         })
     
     if strictness_map['AgtB']:
         qa_pairs.append({
-                            'question_string': "Is %s greater than %s?" % strictness_map['AgtB'], 'question_id': 13,
+                            'question_string': QUESTION_TEMPLATES[13] % strictness_map['AgtB'], 'question_id': 13,
                             'color1_name': strictness_map['AgtB'][0], 'color2_name': strictness_map['AgtB'][1],
                             'answer': 1
                         })
     
     if strictness_map['AintB']:
         qa_pairs.append({
-                            'question_string': "Does %s intersect %s?" % strictness_map['AintB'], 'question_id': 14,
+                            'question_string': QUESTION_TEMPLATES[14] % strictness_map['AintB'], 'question_id': 14,
                             'color1_name': strictness_map['AintB'][0], 'color2_name': strictness_map['AintB'][1],
                             'answer': 1
                         })
     
     if strictness_map['not_AltB']:
         qa_pairs.append({
-                            'question_string': "Is %s less than %s?" % strictness_map['not_AltB'], 'question_id': 12,
+                            'question_string': QUESTION_TEMPLATES[12] % strictness_map['not_AltB'], 'question_id': 12,
                             'color1_name': strictness_map['not_AltB'][0], 'color2_name': strictness_map['not_AltB'][1],
                             'answer': 0
                         })
     
     if strictness_map['not_AgtB']:
         qa_pairs.append({
-                            'question_string': "Is %s greater than %s?" % strictness_map['not_AgtB'], 'question_id': 13,
+                            'question_string': QUESTION_TEMPLATES[13] % strictness_map['not_AgtB'], 'question_id': 13,
                             'color1_name': strictness_map['not_AgtB'][0], 'color2_name': strictness_map['not_AgtB'][1],
                             'answer': 0
                         })
     
     if strictness_map['not_AintB']:
         qa_pairs.append({
-                            'question_string': "Does %s intersect %s?" % strictness_map['not_AintB'], 'question_id': 14,
+                            'question_string': QUESTION_TEMPLATES[14] % strictness_map['not_AintB'], 'question_id': 14,
                             'color1_name': strictness_map['not_AintB'][0], 'color2_name': strictness_map['not_AintB'][1],
                             'answer': 0
                         })
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+import bisect
+import json
+import os
+import struct
+
+import numpy as np
+
+
+SHARD_FORMAT_VERSION = 1
+
+MANIFEST_FILE = "shards.json"
+
+# Record header: image index, then the byte lengths of the PNG, annotations JSON, and QA pairs JSON
+RECORD_HEADER = struct.Struct("<IIII")
+
+# Index entry per record: image index, byte offset of the record in the shard, and its total length
+INDEX_ENTRY = struct.Struct("<IQQ")
+INDEX_DTYPE = np.dtype([('image_index', '<u4'), ('offset', '<u8'), ('length', '<u8')])
+
+
+def _shard_name(shard_id):
+    return "shard-%05d" % shard_id
+
+
+class RecordShardWriter (object):
+    """
+    Packs figures into shard files of about SHARD_SIZE bytes. Each record holds a figure's PNG,
+    annotations, and QA pairs; each shard has an index of record offsets, and MANIFEST_FILE lists the
+    shards and the image indices they hold. Image indices must be written in increasing order without gaps.
+    With APPEND, the shards already listed in an existing manifest are kept and new ones are added after them.
+    """
+
+    def __init__(self, directory, shard_size=256 * 1024 * 1024, append=False):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards = []
+        self.num_images = 0
+        self.totals = (None, None)
+
+        self._rec_f = None
+        self._idx_f = None
+
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+
+        if append and os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+                manifest = json.load(f)
+
+            self.shards = manifest['shards']
+            self.num_images = manifest['num_images']
+            self.totals = (manifest['total_distinct_questions'], manifest['total_distinct_colors'])
+
+    def _open_shard(self, image_index):
+        name = _shard_name(len(self.shards))
+        self.shards.append({'name': name, 'first_image_index': image_index, 'num_images': 0, 'size': 0})
+        self._rec_f = open(os.path.join(self.directory, name + ".rec"), 'wb')
+        self._idx_f = open(os.path.join(self.directory, name + ".idx"), 'wb')
+
+    def _close_shard(self):
+        if self._rec_f:
+            self._rec_f.close()
+            self._idx_f.close()
+            self._rec_f, self._idx_f = None, None
+
+    def write(self, image_index, png_bytes, annotations, qa_pairs):
+        if image_index != self.num_images:
+            raise Exception("Expected image index %d, got %d!" % (self.num_images, image_index))
+
+        if not self._rec_f or self.shards[-1]['size'] >= self.shard_size:
+            self._close_shard()
+            self._open_shard(image_index)
+
+        annotations_bytes = json.dumps(annotations).encode("utf-8")
+        qa_bytes = json.dumps(qa_pairs).encode("utf-8")
+
+        record = b"".join([RECORD_HEADER.pack(image_index, len(png_bytes), len(annotations_bytes), len(qa_bytes)),
+                           png_bytes, annotations_bytes, qa_bytes])
+
+        shard = self.shards[-1]
+        self._idx_f.write(INDEX_ENTRY.pack(image_index, shard['size'], len(record)))
+        self._rec_f.write(record)
+
+        shard['size'] += len(record)
+        shard['num_images'] += 1
+        self.num_images += 1
+
+    def close(self, total_distinct_questions=None, total_distinct_colors=None):
+        self._close_shard()
+
+        if total_distinct_questions is None:
+            total_distinct_questions, total_distinct_colors = self.totals
+
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as f:
+            json.dump({
+                'format_version': SHARD_FORMAT_VERSION,
+                'num_images': self.num_images,
+                'total_distinct_questions': total_distinct_questions,
+                'total_distinct_colors': total_distinct_colors,
+                'shards': self.shards
+            }, f, indent=4)
+
+
+def _decode_record(record):
+    image_index, png_len, annotations_len, qa_len = RECORD_HEADER.unpack_from(record, 0)
+
+    start = RECORD_HEADER.size
+    png_bytes = record[start:start + png_len]
+    start += png_len
+    annotations = json.loads(record[start:start + annotations_len].decode("utf-8"))
+    start += annotations_len
+    qa_pairs = json.loads(record[start:start + qa_len].decode("utf-8"))
+
+    return png_bytes, annotations, qa_pairs
+
+
+class RecordShardReader (object):
+    """
+    Reads a directory written by RecordShardWriter. Figures can be streamed in order by iterating, or
+    looked up by image index with a single read. Both yield (png_bytes, annotations, qa_pairs).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+
+        self.shards = self.manifest['shards']
+        self._first_indices = [shard['first_image_index'] for shard in self.shards]
+        self._indices = [None] * len(self.shards)
+        self._files = [None] * len(self.shards)
+
+    def __len__(self):
+        return self.manifest['num_images']
+
+    def _shard_index(self, shard_id):
+        if self._indices[shard_id] is None:
+            self._indices[shard_id] = np.fromfile(
+                os.path.join(self.directory, self.shards[shard_id]['name'] + ".idx"), dtype=INDEX_DTYPE)
+        return self._indices[shard_id]
+
+    def _shard_file(self, shard_id):
+        if self._files[shard_id] is None:
+            self._files[shard_id] = open(os.path.join(self.directory, self.shards[shard_id]['name'] + ".rec"), 'rb')
+        return self._files[shard_id]
+
+    def __getitem__(self, image_index):
+        if image_index < 0 or image_index >= len(self):
+            raise IndexError("Image index %d out of range!" % image_index)
+
+        shard_id = bisect.bisect_right(self._first_indices, image_index) - 1
+        entry = self._shard_index(shard_id)[image_index - self.shards[shard_id]['first_image_index']]
+
+        f = self._shard_file(shard_id)
+        f.seek(int(entry['offset']))
+        return _decode_record(f.read(int(entry['length'])))
+
+    def __iter__(self):
+        for shard_id, shard in enumerate(self.shards):
+            index = self._shard_index(shard_id)
+
+            with open(os.path.join(self.directory, shard['name'] + ".rec"), 'rb') as f:
+                for entry in index:
+                    yield _decode_record(f.read(int(entry['length'])))
+
+    def close(self):
+        for f in self._files:
+            if f:
+                f.close()
+        self._files = [None] * len(self.shards)
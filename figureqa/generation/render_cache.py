@@ -0,0 +1,84 @@
+#!/usr/bin/python
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+# Bump when the renderer changes in a way that invalidates previously cached figures
+CACHE_VERSION = 1
+
+# Fields of a source data record that determine the rendered figure
+RENDER_FIELDS = ['type', 'data', 'visuals']
+
+
+def get_render_key(source, render_backend="phantomjs"):
+    """ Hashes everything that affects how SOURCE renders. Question-answer pairs are not included. """
+    payload = dict((field, source.get(field)) for field in RENDER_FIELDS)
+    payload['cache_version'] = CACHE_VERSION
+    payload['render_backend'] = render_backend
+
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RenderCache (object):
+    """
+    Content-addressed store of rendered figures. Each entry is the PNG and the rendered data returned
+    by the web driver, keyed by 'get_render_key'.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            # Parallel render workers all create it
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _paths(self, key):
+        subdir = os.path.join(self.cache_dir, key[:2])
+        return subdir, os.path.join(subdir, "%s.png" % key), os.path.join(subdir, "%s.json" % key)
+
+    def get(self, key, png_file):
+        """ Copies the cached image to PNG_FILE and returns the rendered data, or None on a miss. """
+        subdir, cached_png, cached_json = self._paths(key)
+
+        # The JSON is written last, so its presence means the entry is complete
+        if not os.path.exists(cached_json):
+            self.misses += 1
+            return None
+
+        with open(cached_json, 'r') as f:
+            rendered_data = json.load(f)
+
+        shutil.copyfile(cached_png, png_file)
+        self.hits += 1
+
+        return rendered_data
+
+    def put(self, key, png_file, rendered_data):
+        subdir, cached_png, cached_json = self._paths(key)
+
+        if not os.path.exists(subdir):
+            try:
+                os.mkdir(subdir)
+            except OSError:
+                # Another render worker got there first
+                pass
+
+        # Write to temporary files and rename, so concurrent workers never see partial entries
+        fd, tmp_png = tempfile.mkstemp(dir=subdir, suffix=".png.tmp")
+        os.close(fd)
+        shutil.copyfile(png_file, tmp_png)
+        os.rename(tmp_png, cached_png)
+
+        fd, tmp_json = tempfile.mkstemp(dir=subdir, suffix=".json.tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(rendered_data, f)
+        os.rename(tmp_json, cached_json)
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+from __future__ import division
+
+import click
+import heapq
+import json
+import logging
+
+import numpy as np
+
+from data_utils import FIGURE_TYPES
+
+# Columns of the design matrix, after the one-hot figure type columns
+NUMERIC_FEATURES = ["n_models", "n_points", "draw_legend", "figure_width"]
+
+# Rough seconds per figure, used until the model has been calibrated from recorded timings
+DEFAULT_COEFFICIENTS = {
+    'type': {
+        'vbar_categorical': 0.9,
+        'hbar_categorical': 0.9,
+        'pie': 0.7,
+        'line': 1.0,
+        'dot_line': 1.1
+    },
+    'n_models': 0.05,
+    'n_points': 0.01,
+    'draw_legend': 0.15,
+    'figure_width': 0.0005
+}
+
+
+def get_figure_features(source):
+    """ Extracts the features that drive render time from a source data record. """
+    point_sets = source['data']
+    visuals = source.get('visuals', {})
+
+    if source['type'] == 'pie':
+        n_models = len(point_sets[0]['labels'])
+        n_points = n_models
+    elif source['type'] in ['vbar_categorical', 'hbar_categorical']:
+        n_models = 1
+        n_points = len(point_sets[0]['x'])
+    else:
+        n_models = len(point_sets)
+        n_points = sum([len(ps['x']) for ps in point_sets])
+
+    return {
+        'type': source['type'],
+        'n_models': n_models,
+        'n_points': n_points,
+        'draw_legend': 1 if visuals.get('draw_legend') else 0,
+        'figure_width': visuals.get('figure_width', 0)
+    }
+
+
+def _feature_vector(features):
+    one_hot = [1.0 if features['type'] == fig_type else 0.0 for fig_type in FIGURE_TYPES]
+    return one_hot + [float(features[key]) for key in NUMERIC_FEATURES]
+
+
+class RenderCostModel (object):
+    """
+    Linear estimate of the seconds needed to render a figure: a base cost per figure type plus a
+    cost for each of NUMERIC_FEATURES.
+    """
+
+    def __init__(self, coefficients=None):
+        self.coefficients = coefficients if coefficients else DEFAULT_COEFFICIENTS
+
+    @classmethod
+    def calibrate(cls, timing_records):
+        """
+        Fits the model by least squares to records holding the fields of 'get_figure_features'
+        and the measured 'seconds'.
+        """
+        timing_records = list(timing_records)
+        if len(timing_records) == 0:
+            raise Exception("Need at least one timing record to calibrate the cost model!")
+
+        design = np.array([_feature_vector(r) for r in timing_records])
+        seconds = np.array([r['seconds'] for r in timing_records])
+        solution = np.linalg.lstsq(design, seconds, rcond=-1)[0]
+
+        # Types without any timings keep their default base cost
+        seen_types = set([r['type'] for r in timing_records])
+        coefficients = {'type': {}}
+
+        for i, fig_type in enumerate(FIGURE_TYPES):
+            if fig_type in seen_types:
+                coefficients['type'][fig_type] = float(solution[i])
+            else:
+                coefficients['type'][fig_type] = DEFAULT_COEFFICIENTS['type'][fig_type]
+
+        for i, key in enumerate(NUMERIC_FEATURES):
+            coefficients[key] = float(solution[len(FIGURE_TYPES) + i])
+
+        return cls(coefficients)
+
+    @classmethod
+    def load(cls, model_json):
+        with open(model_json, 'r') as f:
+            return cls(json.load(f))
+
+    def save(self, model_json):
+        with open(model_json, 'w') as f:
+            json.dump(self.coefficients, f, indent=4, sort_keys=True)
+
+    def estimate(self, source):
+        return self.estimate_features(get_figure_features(source))
+
+    def estimate_features(self, features):
+        cost = self.coefficients['type'].get(features['type'], 0.0)
+
+        for key in NUMERIC_FEATURES:
+            cost += self.coefficients[key] * features[key]
+
+        # A badly conditioned fit can go negative for tiny figures
+        return max(cost, 0.0)
+
+
+def schedule_longest_first(sources, n_workers, cost_model=None):
+    """
+    Assigns each source record to one of N_WORKERS using the longest-processing-time-first rule:
+    figures are taken in order of decreasing estimated cost and given to the least loaded worker.
+
+    Returns a list of (fig_ids, eta_seconds) per worker, where fig_ids index into SOURCES.
+    """
+    cost_model = cost_model if cost_model else RenderCostModel()
+    costs = [cost_model.estimate(source) for source in sources]
+
+    partitions = [[] for i in range(n_workers)]
+    loads = [(0.0, worker) for worker in range(n_workers)]
+
+    for fig_id in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, worker = heapq.heappop(loads)
+        partitions[worker].append(fig_id)
+        heapq.heappush(loads, (load + costs[fig_id], worker))
+
+    etas = dict((worker, load) for load, worker in loads)
+
+    return [(sorted(partitions[worker]), etas[worker]) for worker in range(n_workers)]
+
+
+def read_timing_records(timing_files, include_cached=False):
+    """ Reads timings or render traces; figures reused from the render cache weren't rendered, and are skipped. """
+    records = []
+
+    for timing_file in timing_files:
+        with open(timing_file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+
+                    if include_cached or not record.get('cached'):
+                        records.append(record)
+
+    return records
+
+
+@click.command()
+@click.argument("model_json")
+@click.argument("timing_files", nargs=-1, required=True)
+def main(model_json, timing_files):
+    """
+    Calibrates the render cost model from TIMING_FILES, written by 'figure_generation.py' with
+    '--timings-file' or '--trace-file', and saves the coefficients to MODEL_JSON.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    records = read_timing_records(timing_files)
+    model = RenderCostModel.calibrate(records)
+    model.save(model_json)
+
+    mean_error = np.mean([abs(model.estimate_features(r) - r['seconds']) for r in records])
+    logging.info("Calibrated render cost model from %d timings, mean absolute error %.3fs" % (len(records), mean_error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+from __future__ import division
+
+import click
+import json
+import timeit
+
+from collections import defaultdict
+
+import numpy as np
+
+from render_cost import get_figure_features, read_timing_records
+
+
+# Phases of the render loop, in the order they run
+TRACE_PHASES = ["cache", "figure", "export", "png_encoding", "annotations", "json", "bboxes"]
+
+# Phases that make up the render time the cost model is calibrated on
+RENDER_PHASES = ["figure", "export"]
+
+PERCENTILES = [50, 90, 99]
+
+
+class FigureTrace (object):
+    """
+    Times the phases of rendering one figure. Each 'lap' adds the time since the previous lap, or since
+    the trace was started, to a phase.
+    """
+
+    def __init__(self, fig_id, source):
+        self.fig_id = fig_id
+        self.source = source
+        self.cached = False
+        self.phases = defaultdict(float)
+
+        self.start = self.last = timeit.default_timer()
+
+    def lap(self, phase):
+        now = timeit.default_timer()
+        self.phases[phase] += now - self.last
+        self.last = now
+
+    def mark_cached(self):
+        self.cached = True
+
+    def record(self):
+        record = get_figure_features(self.source)
+        record['fig_id'] = self.fig_id
+        record['cached'] = self.cached
+        record['seconds'] = round(sum(self.phases[phase] for phase in RENDER_PHASES), 6)
+        record['total_seconds'] = round(self.last - self.start, 6)
+        record['phases'] = dict((phase, round(seconds, 6)) for phase, seconds in self.phases.items())
+        return record
+
+
+class NullFigureTrace (object):
+
+    def lap(self, phase):
+        pass
+
+    def mark_cached(self):
+        pass
+
+
+NULL_FIGURE_TRACE = NullFigureTrace()
+
+
+class RenderTrace (object):
+    """
+    Appends a line of JSON per rendered figure to TRACE_FILE, with the features of 'get_figure_features',
+    whether the render cache was hit, and the seconds of each phase. Traces of figures that weren't
+    cached are also timing records for calibrating the render cost model.
+    """
+
+    def __init__(self, trace_file):
+        self.f = open(trace_file, 'a')
+
+    def figure(self, fig_id, source):
+        return FigureTrace(fig_id, source)
+
+    def write(self, figure_trace):
+        self.f.write(json.dumps(figure_trace.record(), separators=(',', ':'), sort_keys=True) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def summarize_trace(records):
+    """
+    Returns the count, mean, percentiles of PERCENTILES, and max seconds of each phase, and of the
+    total, over RECORDS, and each phase's share of the total time.
+    """
+    phase_seconds = defaultdict(list)
+
+    for record in records:
+        for phase in TRACE_PHASES:
+            phase_seconds[phase].append(record['phases'].get(phase, 0.0))
+        phase_seconds['total'].append(record['total_seconds'])
+
+    overall = sum(phase_seconds['total'])
+    summary = {}
+
+    for phase, seconds in phase_seconds.items():
+        seconds = np.array(seconds)
+        summary[phase] = {
+            'count': len(seconds),
+            'mean': float(seconds.mean()),
+            'max': float(seconds.max()),
+            'share': float(seconds.sum() / overall) if overall > 0 else 0.0,
+            'percentiles': [float(p) for p in np.percentile(seconds, PERCENTILES)]
+        }
+
+    return summary
+
+
+def _print_summary(title, summary):
+    print(title)
+    print("%-14s %8s %10s %s %10s %7s" % ("phase", "count", "mean (ms)",
+                                          " ".join("%10s" % ("p%d (ms)" % p) for p in PERCENTILES), "max (ms)", "share"))
+
+    for phase in TRACE_PHASES + ["total"]:
+        s = summary[phase]
+        print("%-14s %8d %10.2f %s %10.2f %6.1f%%" % (phase, s['count'], 1e3 * s['mean'],
+                                                      " ".join("%10.2f" % (1e3 * p) for p in s['percentiles']),
+                                                      1e3 * s['max'], 100 * s['share']))
+    print("")
+
+
+@click.command()
+@click.argument("trace_files", nargs=-1, required=True)
+@click.option("-n", "--n-slowest", default=10, type=int,
+                help="number of slowest figures to list")
+@click.option("--by-type", flag_value=True,
+                help="also summarize each figure type separately")
+@click.option("--exclude-cached", flag_value=True,
+                help="leave out figures that were reused from the render cache")
+def main(trace_files, n_slowest, by_type, exclude_cached):
+    """
+    Summarizes TRACE_FILES, written by 'figure_generation.py' with '--trace-file': percentiles of the
+    time of each phase of the render loop, and the slowest figures.
+    """
+    records = read_timing_records(trace_files, include_cached=not exclude_cached)
+
+    if not records:
+        print("No figures traced.")
+        return
+
+    _print_summary("All figures (%d, %d from the render cache)" % (
+        len(records), len([r for r in records if r['cached']])), summarize_trace(records))
+
+    if by_type:
+        for fig_type in sorted(set(r['type'] for r in records)):
+            type_records = [r for r in records if r['type'] == fig_type]
+            _print_summary("%s (%d)" % (fig_type, len(type_records)), summarize_trace(type_records))
+
+    print("Slowest figures")
+    print("%8s %-18s %8s %8s %11s  %s" % ("fig_id", "type", "models", "points", "total (ms)", "slowest phases"))
+
+    for record in sorted(records, key=lambda r: r['total_seconds'], reverse=True)[:n_slowest]:
+        phases = sorted(record['phases'].items(), key=lambda item: item[1], reverse=True)[:3]
+        print("%8d %-18s %8d %8d %11.2f  %s" % (record['fig_id'], record['type'], record['n_models'], record['n_points'],
+                                               1e3 * record['total_seconds'],
+                                               ", ".join("%s %.2f" % (phase, 1e3 * s) for phase, s in phases)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,51 +2,72 @@
 from __future__ import division
 
 import argparse
-import json
-import numpy as np
+import math
+import multiprocessing
 import os
 import shutil
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from PIL import Image
+from PIL import Image, ImageDraw
+from tqdm import tqdm
 
+from data_utils import iter_annotation_bboxes, MODEL_ELEMENT_TYPES
+from split_reader import AnnotationsReader
 
-DPI = 80
 
+LINE_WIDTH = 2
 
-def add_bboxes_to_plot(bboxes, color):
-    if type(bboxes) != type([]):
-        bboxes = [bboxes]
+# Overlays are debugging aids, so favour encoding speed over file size
+OVERLAY_COMPRESS_LEVEL = 1
+
+LABELS_LEGEND_ELEMENTS = set([
+    "title", "legend", "legend_label", "legend_preview",
+    "x_axis_label", "x_major_label", "y_axis_label", "y_major_label"
+])
+
+TICKS_GRIDLINES_ELEMENTS = set([
+    "x_major_tick", "x_minor_tick", "x_gridline",
+    "y_major_tick", "y_minor_tick", "y_gridline"
+])
+
+
+def draw_bboxes(image, bboxes, color, line_width=LINE_WIDTH):
+    """ Draws the outline of every box in BBOXES onto IMAGE in place. """
+    draw = ImageDraw.Draw(image)
 
     for bbox in bboxes:
-        plt.gca().add_patch(Rectangle((bbox['x'], bbox['y']), bbox['w'], bbox['h'],
-                            fill=False,
-                            edgecolor=color,
-                            linewidth=2))
+        x0, x1 = sorted([bbox['x'], bbox['x'] + bbox['w']])
+        y0, y1 = sorted([bbox['y'], bbox['y'] + bbox['h']])
 
+        # Nested outlines rather than the width argument, which older Pillow versions lack
+        for i in range(line_width):
+            draw.rectangle([x0 - i, y0 - i, x1 + i, y1 + i], outline=color)
 
-def setup_plot(image):
 
-    # Clear
-    plt.cla()
-    plt.clf()
+def save_overlay(image, bboxes, color, png_file):
+    overlay = image.copy()
+    draw_bboxes(overlay, bboxes, color)
+    overlay.save(png_file, compress_level=OVERLAY_COMPRESS_LEVEL)
 
-    plt.imshow(image)
-    plt.tick_params(labelbottom='off', labelleft='off')
 
-    for spine_pos in ['right', 'left', 'top', 'bottom']:
-        plt.gca().spines[spine_pos].set_color('none')
+def group_overlay_bboxes(annotations):
+    """ Returns the boxes of each model, the label and legend boxes, and the tick and gridline boxes. """
+    model_element = MODEL_ELEMENT_TYPES[annotations['type']]
+    model_bboxes = [[] for _ in annotations['models']]
+    labels_legend, ticks_gridlines = [], []
 
-    # turn off ticks
-    plt.gca().xaxis.set_ticks_position('none')
-    plt.gca().yaxis.set_ticks_position('none')
-    plt.gca().xaxis.set_ticklabels([])
-    plt.gca().yaxis.set_ticklabels([])#
-    plt.tight_layout()
-    px, py, chan = np.asarray(image).shape
-    plt.gcf().set_size_inches(py/DPI, px/DPI)
-    plt.gcf().set_dpi(DPI)
+    for element, model_index, _, bbox in iter_annotation_bboxes(annotations):
+        if element == model_element:
+            model_bboxes[model_index].append(bbox)
+        elif element in LABELS_LEGEND_ELEMENTS:
+            labels_legend.append(bbox)
+        elif element in TICKS_GRIDLINES_ELEMENTS:
+            ticks_gridlines.append(bbox)
+
+        # In the case of a pie chart, show the bounds of the whole pie instead
+        elif element == "plot" and annotations['type'] == 'pie':
+            ticks_gridlines.append(bbox)
+
+    return model_bboxes, labels_legend, ticks_gridlines
 
 
 def generate_all_images_with_bboxes_for_plot(annotations, image, root_dest_dir, color, load_image=False):
@@ -61,104 +82,123 @@ def generate_all_images_with_bboxes_for_plot(annotations, image, root_dest_dir,
     if load_image:
         image = Image.open(image)
 
+    # Decode once, every overlay is drawn on a copy
+    image = image.convert("RGB")
+    model_bboxes, labels_legend, ticks_gridlines = group_overlay_bboxes(annotations)
+
     # all models
-    setup_plot(image)
-    bbox_key = None
-    for model in annotations['models']:
-        if not bbox_key:
-            bbox_key = 'bbox' if 'bbox' in model.keys() else 'bboxes'
+    save_overlay(image, [bbox for bboxes in model_bboxes for bbox in bboxes], color,
+                 os.path.join(dest_dir, "%d_all_models.png" % image_index))
 
-        add_bboxes_to_plot(model[bbox_key], color)
+    # each model separate
+    for model, bboxes in zip(annotations['models'], model_bboxes):
+        save_overlay(image, bboxes, color, os.path.join(dest_dir, "%d_%s_model.png" % (image_index, model['name'])))
 
-    plt.savefig(os.path.join(dest_dir, "%d_all_models.png" % image_index))
+    save_overlay(image, labels_legend, color, os.path.join(dest_dir, "%d_labels_legend.png" % image_index))
+    save_overlay(image, ticks_gridlines, color, os.path.join(dest_dir, "%d_ticks_gridlines.png" % image_index))
 
-    # each model separate
-    for model in annotations['models']:
-        setup_plot(image)
-        add_bboxes_to_plot(model[bbox_key], color)
-        plt.savefig(os.path.join(dest_dir, "%d_%s_model.png" % (image_index, model['name'])))
 
-    general_annot = annotations['general_figure_info']
+def draw_all_bboxes(annotations, image, color):
+    """ Returns a copy of IMAGE with every box of the figure drawn on it. """
+    model_bboxes, labels_legend, ticks_gridlines = group_overlay_bboxes(annotations)
+
+    overlay = image.convert("RGB")
+    draw_bboxes(overlay, [bbox for bboxes in model_bboxes for bbox in bboxes] + labels_legend + ticks_gridlines, color)
+    return overlay
+
+
+def make_contact_sheet(split, image_indices, image_paths, color, cell_width=320):
+    """ Tiles the figures of IMAGE_INDICES, with all their boxes drawn, into one captioned mosaic. """
+    n_columns = int(math.ceil(math.sqrt(len(image_indices))))
+    n_rows = int(math.ceil(len(image_indices) / n_columns))
+
+    cells = []
+    for image_index, image_path in zip(image_indices, image_paths):
+        cell = draw_all_bboxes(split.annotations(image_index), Image.open(image_path), color)
+        cell.thumbnail((cell_width, cell_width * 4))
+        ImageDraw.Draw(cell).text((4, 4), "%d (%s)" % (image_index, split.figure_type(image_index)), fill=color)
+        cells.append(cell)
 
-    # labels and legend
-    setup_plot(image)
-    add_bboxes_to_plot(general_annot['title']['bbox'], color)
+    cell_height = max(cell.size[1] for cell in cells)
+    sheet = Image.new("RGB", (n_columns * cell_width, n_rows * cell_height), "white")
 
-    if 'legend' in general_annot:
-        legend_annot = general_annot['legend']
-        add_bboxes_to_plot(legend_annot['bbox'], color)
-        add_bboxes_to_plot([item['label']['bbox'] for item in legend_annot['items']], color)
-        add_bboxes_to_plot([item['preview']['bbox'] for item in legend_annot['items']], color)
+    for i, cell in enumerate(cells):
+        sheet.paste(cell, ((i % n_columns) * cell_width, (i // n_columns) * cell_height))
 
-    if 'x_axis' in general_annot:
-        x_annot = general_annot['x_axis']
-        add_bboxes_to_plot(x_annot['major_labels']['bboxes'], color)
-        add_bboxes_to_plot(x_annot['label']['bbox'], color)
+    return sheet
 
-    if 'y_axis' in general_annot:
-        y_annot = general_annot['y_axis']
-        add_bboxes_to_plot(y_annot['major_labels']['bboxes'], color)
-        add_bboxes_to_plot(y_annot['label']['bbox'], color)
 
-    plt.savefig(os.path.join(dest_dir, "%d_labels_legend.png" % image_index))
+def _init_worker(annotations_json, spans):
+    global worker_split
+    worker_split = AnnotationsReader(annotations_json, spans)
 
-    # ticks and gridlines
-    setup_plot(image)
-    if 'x_axis' in general_annot:
-        x_annot = general_annot['x_axis']
-        add_bboxes_to_plot(x_annot['major_ticks']['bboxes'], color)
-        add_bboxes_to_plot(x_annot['minor_ticks']['bboxes'], color)
 
-    if 'y_axis' in general_annot:
-        y_annot = general_annot['y_axis']
-        add_bboxes_to_plot(y_annot['major_ticks']['bboxes'], color)
-        add_bboxes_to_plot(y_annot['minor_ticks']['bboxes'], color)
+def _visualize_figure(task):
+    image_index, image_path, dest_dir, color = task
+    generate_all_images_with_bboxes_for_plot(worker_split.annotations(image_index), Image.open(image_path),
+                                             dest_dir, color)
 
-    if 'x_gridlines' in general_annot:
-        add_bboxes_to_plot(general_annot['x_gridlines']['bboxes'], color)
 
-    if 'y_gridlines' in general_annot:
-        add_bboxes_to_plot(general_annot['y_gridlines']['bboxes'], color)
+def _visualize_contact_sheet(task):
+    image_indices, image_paths, dest_dir, color = task
+    sheet = make_contact_sheet(worker_split, image_indices, image_paths, color)
+    sheet.save(os.path.join(dest_dir, "contact_sheet_%d-%d.png" % (image_indices[0], image_indices[-1])),
+               compress_level=OVERLAY_COMPRESS_LEVEL)
 
-    # In the case of a pie chart, show the bounds of the whole pie instead
-    if annotations['type'] == 'pie':
-        add_bboxes_to_plot(general_annot['plot_info']['bbox'], color)
 
-    plt.savefig(os.path.join(dest_dir, "%d_ticks_gridlines.png" % image_index))
+def visualize_split(annotations_json, dest_dir, image_indices=None, source_dir=None, color="red",
+                    n_workers=None, contact_sheet_size=0):
+    """
+    Writes the bounding box overlays of IMAGE_INDICES, or of every figure, in ANNOTATIONS_JSON of a
+    combined split on a process pool. With CONTACT_SHEET_SIZE > 0, writes one mosaic per that many
+    figures instead. Only DEST_DIR is written to.
+    """
+    split = AnnotationsReader(annotations_json)
+
+    if image_indices is None:
+        image_indices = [int(i) for i in split.image_indices]
+
+    if source_dir:
+        image_paths = [os.path.join(source_dir, "%d.png" % i) for i in image_indices]
+    else:
+        image_paths = [split.image_path(i) for i in image_indices]
+
+    if contact_sheet_size > 0:
+        worker = _visualize_contact_sheet
+        tasks = [(image_indices[i:i + contact_sheet_size], image_paths[i:i + contact_sheet_size], dest_dir, color)
+                 for i in range(0, len(image_indices), contact_sheet_size)]
+    else:
+        worker = _visualize_figure
+        tasks = [(image_index, image_path, dest_dir, color) for image_index, image_path in zip(image_indices, image_paths)]
+
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(annotations_json, split.spans))
+
+    try:
+        for _ in tqdm(pool.imap_unordered(worker, tasks), total=len(tasks), desc="Drawing bounding boxes"):
+            pass
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-a", "--annotations-json")
-    parser.add_argument("-i", "--images", nargs="+")
-    parser.add_argument("-s", "--source-dir")
+    parser.add_argument("-a", "--annotations-json", help="annotations.json of a split combined with 'json_combiner.py'")
+    parser.add_argument("-i", "--images", nargs="+", help="image indices to draw, defaults to all of the split")
+    parser.add_argument("-s", "--source-dir", help="directory of the images, defaults to png/ of the split")
     parser.add_argument("-d", "--dest-dir")
     parser.add_argument("-c", "--color", default="red")
+    parser.add_argument("-w", "--n-workers", type=int, default=None,
+                        help="number of drawing processes, defaults to the number of CPUs")
+    parser.add_argument("--contact-sheet", type=int, default=0, metavar="N",
+                        help="write one mosaic per N figures instead of the overlays of each figure")
     args = parser.parse_args()
 
     if not os.path.exists(args.dest_dir):
         os.mkdir(args.dest_dir)
 
-    with open(args.annotations_json, 'r') as f:
-        all_annotations = json.load(f)
-
-    if args.images:
-        raw_image_paths = args.images
-        image_paths = []
-        for img in raw_image_paths:
-            if not img.endswith(".png"):
-                image_paths.append(os.path.join(args.source_dir, "%s.png" % img))
-    else:
-        image_paths = [os.path.join(args.source_dir, fp) for fp in os.listdir(args.source_dir) if fp.endswith(".png")]
-
-    for image in image_paths:
-
-        image_index = int(os.path.basename(image).replace(".png", ""))
-        annotations = all_annotations[image_index]
-
-        if annotations['image_index'] != image_index:
-            raise Exception("Image index mismatch!")
+    image_indices = [int(os.path.basename(img).replace(".png", "")) for img in args.images] if args.images else None
 
-        img = Image.open(image)
-        generate_all_images_with_bboxes_for_plot(annotations, img, args.dest_dir, args.color, load_image=False)
+    visualize_split(args.annotations_json, args.dest_dir, image_indices, args.source_dir, args.color,
+                    args.n_workers, args.contact_sheet)
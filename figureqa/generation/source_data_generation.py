@@ -8,7 +8,8 @@ import yaml
 
 from tqdm import tqdm
 
-from data_utils import combine_source_and_rendered_data, get_best_inside_legend_position, hex_to_rgb
+from data_utils import combine_source_and_rendered_data, get_best_inside_legend_position, read_color_map
+from profiling import create_profiler, null_profile
 from questions.categorical import generate_bar_graph_questions, generate_pie_chart_questions
 from questions.lines import generate_line_plot_questions
 from questions.utils import balance_questions_by_qid, NUM_DISTINCT_QS
@@ -494,6 +495,25 @@ def generate_pie():
     return pie_data
 
 
+def load_generation_config(
+        data_config_yaml,
+        common_config_yaml=os.path.join("config", "common_source_data.yaml"),
+        colors=os.path.join("resources", "x11_colors_refined.txt")
+    ):
+    """ Loads the plotting configs and the color map that the 'generate_*' functions read. """
+    global data_config
+    global common_config
+    global color_map
+
+    with open(data_config_yaml, 'r') as f:
+        data_config = yaml.load(f)
+
+    with open(common_config_yaml, 'r') as f:
+        common_config = yaml.load(f)
+
+    color_map = read_color_map(colors)
+
+
 def generate_source_data (
         data_config_yaml,
         output_file_json,
@@ -505,7 +525,9 @@ def generate_source_data (
         hbar=0,
         pie=0,
         line=0,
-        dot_line=0
+        dot_line=0,
+        profile_dir=None,
+        profile_every=1
     ):
 
     PLOT_KEY_PAIRS = [("vbar", "vbar_categorical"), ("hbar", "hbar_categorical"), ("pie", None), ("line", None), ("dot_line", None)]
@@ -514,30 +536,14 @@ def generate_source_data (
             or any([locals()[arg_name] < 0 for arg_name, actual_name in PLOT_KEY_PAIRS]):
         raise Exception("Invalid number of figures! Need at least one plot type specified!")
 
-    global data_config
-    global common_config
-
-    with open(data_config_yaml, 'r') as f:
-        data_config = yaml.load(f)
-
-    with open(common_config_yaml, 'r') as f:
-        common_config = yaml.load(f)
+    load_generation_config(data_config_yaml, common_config_yaml, colors)
 
     # Set the seed
     np.random.seed(seed)
     random.seed(seed)
 
-    # Read the colors and create a map
-    global color_map
-    color_map = {}
-    color_count = 0
-
-    with open(os.path.normpath(colors), 'r') as f:
-        for w in f.readlines():
-            name, color = w.split(',')
-            color = color.strip()
-            color_map[name] = {'id': color_count, 'hex': color, 'rgb': hex_to_rgb(color)}
-            color_count += 1
+    profiler = create_profiler(profile_dir, "source_data", profile_every)
+    profile = profiler.profile if profiler else null_profile
 
     generated_data = []
 
@@ -553,18 +559,23 @@ def generate_source_data (
                 config_key = args_key
 
             if config_key in data_config:
-                generated_data.append(globals()['generate_' + config_key]())
+                with profile(len(generated_data)):
+                    generated_data.append(globals()['generate_' + config_key]())
+
+    with profile():
+        # Balance by question ID
+        if not keep_all_questions:
+            balance_questions_by_qid(generated_data)
 
-    # Balance by question ID
-    if not keep_all_questions:
-        balance_questions_by_qid(generated_data)
+        with open(output_file_json, 'w') as f:
+            json.dump({
+                'data': generated_data, 
+                'total_distinct_questions': NUM_DISTINCT_QS,
+                'total_distinct_colors': len(color_map)
+            }, f)
 
-    with open(output_file_json, 'w') as f:
-        json.dump({
-            'data': generated_data, 
-            'total_distinct_questions': NUM_DISTINCT_QS,
-            'total_distinct_colors': len(color_map)
-        }, f)
+    if profiler:
+        profiler.save()
 
 
 @click.command()
@@ -588,6 +599,10 @@ def generate_source_data (
                 help="number of line plots")
 @click.option("--dot-line", default=0, type=int,
                 help="number of dotted line plots")
+@click.option("--profile", "profile_dir", default=None,
+                help="directory to write cProfile stats and collapsed stacks of the run to")
+@click.option("--profile-every", default=1, type=int,
+                help="with '--profile', only profile every Nth figure to keep the overhead low")
 def main (**kwargs):
     """
     Generates source data and questions for figures using the plotting parameters and colors
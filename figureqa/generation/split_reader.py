@@ -0,0 +1,287 @@
+#!/usr/bin/python
+import json
+import os
+import re
+
+from collections import OrderedDict
+
+import numpy as np
+
+from data_utils import FIGURE_TYPES
+
+
+INDEX_FILE = "figureqa_index.npz"
+INDEX_VERSION = 1
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_QA_PAIRS_KEY = re.compile(r'"qa_pairs"\s*:\s*\[')
+
+
+def iter_json_array(f, array_offset, chunk_size=16 * 1024 * 1024):
+    """
+    Parses the JSON array of objects whose '[' is at byte ARRAY_OFFSET of the binary file F one
+    object at a time, yielding (start, end, obj) with the byte span of each object. Only a chunk of
+    the file is held in memory at once. Expects ASCII JSON, which is what json.dump writes by default.
+    """
+    decoder = json.JSONDecoder()
+
+    f.seek(array_offset + 1)
+    buf, buf_offset, pos, eof = "", array_offset + 1, 0, False
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+
+        # Keep at least a full object in the buffer, or everything that is left
+        if pos == len(buf) or not eof and len(buf) - pos < chunk_size // 2:
+            if eof and pos == len(buf):
+                raise ValueError("Unterminated JSON array at byte %d" % array_offset)
+
+            chunk = f.read(chunk_size)
+            eof = len(chunk) < chunk_size
+            buf, buf_offset, pos = buf[pos:] + chunk.decode("ascii"), buf_offset + pos, 0
+            continue
+
+        if buf[pos] == "]":
+            return
+
+        if buf[pos] == ",":
+            pos += 1
+            continue
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+
+            # The object runs past the buffer, so read a bigger chunk
+            chunk = f.read(chunk_size)
+            eof = len(chunk) < chunk_size
+            buf, buf_offset, pos = buf[pos:] + chunk.decode("ascii"), buf_offset + pos, 0
+            chunk_size *= 2
+            continue
+
+        yield buf_offset + pos, buf_offset + end, obj
+        pos = end
+
+
+def find_qa_pairs_array(f):
+    """ Returns the byte offset of the '[' of the "qa_pairs" array in a qa_pairs.json file. """
+    head = f.read(4096).decode("ascii")
+    match = _QA_PAIRS_KEY.search(head)
+
+    if not match:
+        raise ValueError("No 'qa_pairs' array at the start of the file!")
+
+    return match.end() - 1
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return np.array([stat.st_size, int(stat.st_mtime * 1e6)], dtype=np.int64)
+
+
+def build_split_index(split_directory):
+    """ Scans annotations.json and qa_pairs.json of a combined split for the byte span of every record. """
+    ann_rows = []
+    with open(os.path.join(split_directory, "annotations.json"), 'rb') as f:
+        for start, end, annotations in iter_json_array(f, 0):
+            ann_rows.append((annotations['image_index'], start, end, FIGURE_TYPES.index(annotations['type'])))
+
+    qa_rows = []
+    with open(os.path.join(split_directory, "qa_pairs.json"), 'rb') as f:
+        for start, end, qa in iter_json_array(f, find_qa_pairs_array(f)):
+            qa_rows.append((qa['image_index'], start, end, qa['question_id'], qa['answer']))
+
+    ann_rows = np.array(ann_rows, dtype=np.int64).reshape(-1, 4)
+    qa_rows = np.array(qa_rows, dtype=np.int64).reshape(-1, 5)
+
+    return {
+        'version': np.array(INDEX_VERSION),
+        'annotations_signature': _file_signature(os.path.join(split_directory, "annotations.json")),
+        'qa_pairs_signature': _file_signature(os.path.join(split_directory, "qa_pairs.json")),
+        'ann_image_index': ann_rows[:, 0], 'ann_start': ann_rows[:, 1], 'ann_end': ann_rows[:, 2],
+        'ann_type': ann_rows[:, 3].astype(np.int8),
+        'qa_image_index': qa_rows[:, 0], 'qa_start': qa_rows[:, 1], 'qa_end': qa_rows[:, 2],
+        'qa_question_id': qa_rows[:, 3].astype(np.int16), 'qa_answer': qa_rows[:, 4].astype(np.int8)
+    }
+
+
+def load_split_index(split_directory, rebuild=False):
+    """
+    Loads the index of a combined split, building it and saving it next to the JSON files when it is
+    missing or older than them.
+    """
+    index_file = os.path.join(split_directory, INDEX_FILE)
+
+    if os.path.exists(index_file) and not rebuild:
+        with np.load(index_file) as stored:
+            index = dict((key, stored[key]) for key in stored.files)
+
+        if int(index['version']) == INDEX_VERSION \
+                and (index['annotations_signature'] == _file_signature(os.path.join(split_directory, "annotations.json"))).all() \
+                and (index['qa_pairs_signature'] == _file_signature(os.path.join(split_directory, "qa_pairs.json"))).all():
+            return index
+
+    index = build_split_index(split_directory)
+
+    try:
+        np.savez(index_file, **index)
+    except (IOError, OSError):
+        # Read-only split, so the index is only kept in memory
+        pass
+
+    return index
+
+
+class FigureQASplit (object):
+    """
+    Random access to the annotations and QA pairs of a split combined with 'json_combiner.py', by
+    image index, without loading the whole JSON files. Each lookup is a single read of the record's
+    bytes; recently used records are kept in an LRU cache of CACHE_SIZE entries. Returned records are
+    shared with the cache, so treat them as read-only. INDEX of another split of the same directory
+    can be given to skip loading it, e.g. to share it with worker processes.
+    """
+
+    def __init__(self, split_directory, cache_size=1024, index=None):
+        self.split_directory = split_directory
+        self.cache_size = cache_size
+        self.index = index if index is not None else load_split_index(split_directory)
+
+        self._cache = OrderedDict()
+        self._files = {}
+        self._pid = None
+
+        self.image_indices = self.index['ann_image_index']
+        size = int(self.image_indices.max()) + 1 if len(self.image_indices) else 0
+
+        self._ann_row = np.full(size, -1, dtype=np.int64)
+        self._ann_row[self.image_indices] = np.arange(len(self.image_indices))
+
+        # QA pairs of an image are consecutive in the file, so remember the first and last row
+        qa_image_index = self.index['qa_image_index']
+        self._qa_first = np.full(size, -1, dtype=np.int64)
+        self._qa_last = np.full(size, -1, dtype=np.int64)
+        with_qas, first_rows = np.unique(qa_image_index, return_index=True)
+        self._qa_first[with_qas] = first_rows
+        with_qas, last_rows = np.unique(qa_image_index[::-1], return_index=True)
+        self._qa_last[with_qas] = len(qa_image_index) - 1 - last_rows
+
+    def __len__(self):
+        return len(self.image_indices)
+
+    def __contains__(self, image_index):
+        return 0 <= image_index < len(self._ann_row) and self._ann_row[image_index] >= 0
+
+    def _read(self, name, start, end):
+        # File offsets are shared with forked processes, so each process opens its own files
+        if self._pid != os.getpid():
+            self._files, self._pid = {}, os.getpid()
+
+        if name not in self._files:
+            self._files[name] = open(os.path.join(self.split_directory, name), 'rb')
+
+        f = self._files[name]
+        f.seek(start)
+        return f.read(end - start).decode("ascii")
+
+    def _cached(self, key, load):
+        if key in self._cache:
+            value = self._cache.pop(key)
+        else:
+            value = load()
+
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+
+        self._cache[key] = value
+        return value
+
+    def _load_annotations(self, image_index):
+        if image_index not in self:
+            raise KeyError("No image with index %d!" % image_index)
+
+        row = self._ann_row[image_index]
+        return json.loads(self._read("annotations.json", int(self.index['ann_start'][row]), int(self.index['ann_end'][row])))
+
+    def _load_qa_pairs(self, image_index):
+        if image_index not in self:
+            raise KeyError("No image with index %d!" % image_index)
+
+        first, last = self._qa_first[image_index], self._qa_last[image_index]
+        if first < 0:
+            return []
+
+        # One read covering all the image's QA pairs and the separators between them
+        text = self._read("qa_pairs.json", int(self.index['qa_start'][first]), int(self.index['qa_end'][last]))
+        return json.loads("[" + text + "]")
+
+    def annotations(self, image_index):
+        return self._cached(('annotations', image_index), lambda: self._load_annotations(image_index))
+
+    def qa_pairs(self, image_index):
+        return self._cached(('qa_pairs', image_index), lambda: self._load_qa_pairs(image_index))
+
+    def image_path(self, image_index):
+        return os.path.join(self.split_directory, "png", "%d.png" % image_index)
+
+    def figure_type(self, image_index):
+        return FIGURE_TYPES[self.index['ann_type'][self._ann_row[image_index]]]
+
+    def iter_annotations(self):
+        """ Streams all annotations in file order, bypassing the cache. """
+        with open(os.path.join(self.split_directory, "annotations.json"), 'rb') as f:
+            for start, end, annotations in iter_json_array(f, 0):
+                yield annotations
+
+    def iter_qa_pairs(self):
+        """ Streams all QA pairs in file order, bypassing the cache. """
+        with open(os.path.join(self.split_directory, "qa_pairs.json"), 'rb') as f:
+            for start, end, qa in iter_json_array(f, find_qa_pairs_array(f)):
+                yield qa
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class AnnotationsReader (object):
+    """
+    Random access to the records of a single annotations JSON file by image index. Unlike FigureQASplit,
+    nothing else of the split is needed and nothing is written: the byte span of each record is found
+    by one scan, or taken from SPANS of another reader, e.g. to share them with worker processes.
+    """
+
+    def __init__(self, annotations_json, spans=None):
+        self.annotations_json = annotations_json
+
+        if spans is None:
+            rows = []
+            with open(annotations_json, 'rb') as f:
+                for start, end, annotations in iter_json_array(f, 0):
+                    rows.append((annotations['image_index'], start, end, FIGURE_TYPES.index(annotations['type'])))
+            spans = np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+        self.spans = spans
+        self.image_indices = spans[:, 0]
+        self._rows = dict((int(image_index), row) for row, image_index in enumerate(self.image_indices))
+        self._f, self._pid = None, None
+
+    def annotations(self, image_index):
+        if image_index not in self._rows:
+            raise KeyError("No image with index %d!" % image_index)
+
+        # File offsets are shared with forked processes, so each process opens its own file
+        if self._pid != os.getpid():
+            self._f, self._pid = open(self.annotations_json, 'rb'), os.getpid()
+
+        _, start, end, _ = self.spans[self._rows[image_index]]
+        self._f.seek(start)
+        return json.loads(self._f.read(end - start).decode("ascii"))
+
+    def image_path(self, image_index):
+        return os.path.join(os.path.dirname(os.path.abspath(self.annotations_json)), "png", "%d.png" % image_index)
+
+    def figure_type(self, image_index):
+        return FIGURE_TYPES[self.spans[self._rows[image_index], 3]]
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+import click
+import json
+import logging
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from data_utils import FIGURE_TYPES
+from file_transfer import transfer_file
+from json_streaming import JSONArrayWriter
+from split_reader import find_qa_pairs_array, load_split_index
+
+
+SUBSET_MANIFEST_FILE = "subset.json"
+
+# Renaming would take the images out of the source split
+SUBSET_TRANSFER_MODES = ["hardlink", "symlink", "reflink", "copy"]
+
+
+def parse_question_ids(question_ids):
+    """ Parses question ids given as e.g. ["0", "12-14"] into a sorted list of ints. """
+    parsed = set()
+
+    for qids in question_ids:
+        for part in qids.split(","):
+            if "-" in part:
+                first, last = part.split("-")
+                parsed.update(range(int(first), int(last) + 1))
+            else:
+                parsed.add(int(part))
+
+    return sorted(parsed)
+
+
+def select_subset(index, figure_types=None, question_ids=None, answer=None, max_images=-1, keep_empty=False):
+    """
+    Returns the annotation rows and QA pair rows of a split index, see 'split_reader.py', that pass the
+    filters. Images left without QA pairs by the question filters are dropped unless KEEP_EMPTY.
+    """
+    ann_mask = np.ones(len(index['ann_image_index']), dtype=bool)
+    qa_mask = np.ones(len(index['qa_image_index']), dtype=bool)
+
+    if figure_types:
+        ann_mask &= np.isin(index['ann_type'], [FIGURE_TYPES.index(t) for t in figure_types])
+
+    if question_ids:
+        qa_mask &= np.isin(index['qa_question_id'], question_ids)
+
+    if answer is not None:
+        qa_mask &= index['qa_answer'] == answer
+
+    qa_mask &= np.isin(index['qa_image_index'], index['ann_image_index'][ann_mask])
+
+    if (question_ids or answer is not None) and not keep_empty:
+        ann_mask &= np.isin(index['ann_image_index'], index['qa_image_index'][qa_mask])
+
+    ann_rows = np.where(ann_mask)[0]
+
+    if max_images >= 0:
+        ann_rows = ann_rows[:max_images]
+        qa_mask &= np.isin(index['qa_image_index'], index['ann_image_index'][ann_rows])
+
+    return ann_rows, np.where(qa_mask)[0]
+
+
+def _read_record(f, start, end):
+    f.seek(start)
+    return json.loads(f.read(end - start).decode("ascii"))
+
+
+def _read_qa_wrapper(qa_f, index):
+    """ Returns the text before and after the "qa_pairs" array of a qa_pairs.json file. """
+    array_offset = find_qa_pairs_array(qa_f)
+
+    qa_f.seek(0)
+    head = qa_f.read(array_offset).decode("ascii")
+
+    qa_f.seek(int(index['qa_end'][-1]) if len(index['qa_end']) else array_offset + 1)
+    rest = qa_f.read().decode("ascii")
+    tail = rest[rest.index("]") + 1:]
+
+    return head, tail
+
+
+def build_subset(
+        split_directory,
+        destination_directory,
+        figure_types=None,
+        question_ids=None,
+        answer=None,
+        max_images=-1,
+        keep_empty=False,
+        transfer_mode="hardlink"
+    ):
+    """
+    Writes the images, annotations, and QA pairs of a combined split that pass the filters to
+    DESTINATION_DIRECTORY as a split of its own. Records are selected with the split index and copied
+    one at a time, images are linked rather than copied by default, and images are renumbered from 0;
+    SUBSET_MANIFEST_FILE maps them back to the image indices of the source split.
+    """
+    index = load_split_index(split_directory)
+    ann_rows, qa_rows = select_subset(index, figure_types, question_ids, answer, max_images, keep_empty)
+
+    source_image_index = index['ann_image_index'][ann_rows]
+    new_image_index = dict((int(old), new) for new, old in enumerate(source_image_index))
+
+    logging.info("Selected %d of %d images and %d of %d QA pairs" % (
+        len(ann_rows), len(index['ann_image_index']), len(qa_rows), len(index['qa_image_index'])))
+
+    dest_png_dir = os.path.join(destination_directory, "png")
+    if not os.path.exists(dest_png_dir):
+        os.makedirs(dest_png_dir)
+
+    with open(os.path.join(split_directory, "annotations.json"), 'rb') as src_f, \
+            open(os.path.join(destination_directory, "annotations.json"), 'w') as dest_f:
+        writer = JSONArrayWriter(dest_f)
+
+        for row in tqdm(ann_rows, desc="Writing annotations and images"):
+            annotations = _read_record(src_f, int(index['ann_start'][row]), int(index['ann_end'][row]))
+            old_index = annotations['image_index']
+            annotations['image_index'] = new_image_index[old_index]
+            writer.write(annotations)
+
+            transfer_file(os.path.join(split_directory, "png", "%d.png" % old_index),
+                          os.path.join(dest_png_dir, "%d.png" % annotations['image_index']), transfer_mode)
+
+        writer.close()
+
+    with open(os.path.join(split_directory, "qa_pairs.json"), 'rb') as src_f, \
+            open(os.path.join(destination_directory, "qa_pairs.json"), 'w') as dest_f:
+        head, tail = _read_qa_wrapper(src_f, index)
+        writer = JSONArrayWriter(dest_f, head)
+
+        for row in tqdm(qa_rows, desc="Writing QA pairs"):
+            qa = _read_record(src_f, int(index['qa_start'][row]), int(index['qa_end'][row]))
+            qa['image_index'] = new_image_index[qa['image_index']]
+            writer.write(qa)
+
+        writer.close(tail)
+
+    with open(os.path.join(destination_directory, SUBSET_MANIFEST_FILE), 'w') as f:
+        json.dump({
+            'source_directory': os.path.abspath(split_directory),
+            'figure_types': figure_types,
+            'question_ids': question_ids,
+            'answer': answer,
+            'max_images': max_images,
+            'source_image_index': source_image_index.tolist()
+        }, f)
+
+
+@click.command()
+@click.argument("split_directory")
+@click.argument("destination_directory")
+@click.option("-t", "--figure-type", "figure_types", multiple=True, type=click.Choice(FIGURE_TYPES),
+                help="keep only figures of this type, can be repeated")
+@click.option("-q", "--question-id", "question_ids", multiple=True,
+                help="keep only questions with these ids, e.g. '12-14' or '0,1', can be repeated")
+@click.option("-a", "--answer", default=None, type=click.Choice(["0", "1"]),
+                help="keep only questions with this answer")
+@click.option("-n", "--max-images", default=-1, type=int,
+                help="keep at most this many images, the first ones that pass the other filters")
+@click.option("--keep-empty", flag_value=True,
+                help="keep images left without questions by the question filters")
+@click.option("-m", "--transfer-mode", default="hardlink", type=click.Choice(SUBSET_TRANSFER_MODES),
+                help="how images are put in DESTINATION_DIRECTORY")
+def main(split_directory, destination_directory, figure_types, question_ids, answer, max_images, keep_empty, transfer_mode):
+    """
+    Writes the part of SPLIT_DIRECTORY, produced by 'json_combiner.py', that passes the filters to
+    DESTINATION_DIRECTORY, in the same format.
+    """
+    logging.basicConfig(level=logging.INFO)
+    build_subset(split_directory, destination_directory, list(figure_types), parse_question_ids(question_ids),
+                 int(answer) if answer is not None else None, max_images, keep_empty, transfer_mode)
+
+
+if __name__ == "__main__":
+    main()
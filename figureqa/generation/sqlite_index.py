@@ -0,0 +1,156 @@
+#!/usr/bin/python
+import click
+import logging
+import os
+import sqlite3
+
+from tqdm import tqdm
+
+from data_utils import iter_annotation_bboxes
+from split_reader import FigureQASplit
+
+
+SCHEMA = [
+    """CREATE TABLE images (
+        image_index INTEGER PRIMARY KEY,
+        type TEXT NOT NULL,
+        n_models INTEGER NOT NULL,
+        width INTEGER,
+        height INTEGER
+    )""",
+    """CREATE TABLE qa_pairs (
+        qa_id INTEGER PRIMARY KEY,
+        image_index INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        question_string TEXT NOT NULL,
+        answer INTEGER NOT NULL,
+        color1_id INTEGER,
+        color1_name TEXT,
+        color2_id INTEGER,
+        color2_name TEXT
+    )""",
+    """CREATE TABLE models (
+        image_index INTEGER NOT NULL,
+        model_index INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        n_bboxes INTEGER NOT NULL,
+        PRIMARY KEY (image_index, model_index)
+    )""",
+    """CREATE TABLE bboxes (
+        image_index INTEGER NOT NULL,
+        element TEXT NOT NULL,
+        model_index INTEGER NOT NULL,
+        item_index INTEGER NOT NULL,
+        x REAL, y REAL, w REAL, h REAL
+    )"""
+]
+
+# Created after the bulk load, which is much faster than maintaining them during it
+INDEXES = [
+    "CREATE INDEX images_type ON images (type, n_models)",
+    "CREATE INDEX qa_pairs_question ON qa_pairs (question_id, answer)",
+    "CREATE INDEX qa_pairs_image ON qa_pairs (image_index)",
+    "CREATE INDEX qa_pairs_color1 ON qa_pairs (color1_id)",
+    "CREATE INDEX qa_pairs_color2 ON qa_pairs (color2_id)",
+    "CREATE INDEX models_name ON models (name)",
+    "CREATE INDEX bboxes_image ON bboxes (image_index, element)",
+    "CREATE INDEX bboxes_element ON bboxes (element)"
+]
+
+BATCH_SIZE = 10000
+
+
+def _image_rows(annotations):
+    figure_bbox = annotations['general_figure_info'].get('figure_info', {}).get('bbox', {}).get('bbox', {})
+
+    image_row = (annotations['image_index'], annotations['type'], len(annotations['models']),
+                 figure_bbox.get('w'), figure_bbox.get('h'))
+
+    model_rows = []
+    for i, model in enumerate(annotations['models']):
+        n_bboxes = len(model['bboxes']) if 'bboxes' in model else 1 if 'bbox' in model else 0
+        model_rows.append((annotations['image_index'], i, model['name'], n_bboxes))
+
+    bbox_rows = [(annotations['image_index'], element, model_index, item_index,
+                  bbox['x'], bbox['y'], bbox['w'], bbox['h'])
+                 for element, model_index, item_index, bbox in iter_annotation_bboxes(annotations)]
+
+    return image_row, model_rows, bbox_rows
+
+
+def _flush(connection, rows):
+    connection.executemany("INSERT INTO images VALUES (?, ?, ?, ?, ?)", rows['images'])
+    connection.executemany("INSERT INTO models VALUES (?, ?, ?, ?)", rows['models'])
+    connection.executemany("INSERT INTO bboxes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows['bboxes'])
+    connection.executemany("INSERT INTO qa_pairs VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)", rows['qa_pairs'])
+
+    for key in rows:
+        rows[key] = []
+
+
+def build_sqlite_index(split_directory, database_file=None):
+    """
+    Bulk-loads the images, QA pairs, models, and bounding boxes of a split combined with
+    'json_combiner.py' into an indexed SQLite database.
+    """
+    database_file = database_file if database_file else os.path.join(split_directory, "figureqa.sqlite")
+
+    if os.path.exists(database_file):
+        os.remove(database_file)
+
+    split = FigureQASplit(split_directory)
+    connection = sqlite3.connect(database_file)
+
+    # Nothing to recover if the load fails, so skip the journal and syncs
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+
+    for statement in SCHEMA:
+        connection.execute(statement)
+
+    rows = {'images': [], 'models': [], 'bboxes': [], 'qa_pairs': []}
+
+    for annotations in tqdm(split.iter_annotations(), total=len(split), desc="Loading annotations"):
+        image_row, model_rows, bbox_rows = _image_rows(annotations)
+        rows['images'].append(image_row)
+        rows['models'] += model_rows
+        rows['bboxes'] += bbox_rows
+
+        if len(rows['bboxes']) >= BATCH_SIZE:
+            _flush(connection, rows)
+
+    for qa in tqdm(split.iter_qa_pairs(), total=len(split.index['qa_image_index']), desc="Loading QA pairs"):
+        rows['qa_pairs'].append((qa['image_index'], qa['question_id'], qa['question_string'], qa['answer'],
+                                 qa.get('color1_id'), qa['color1_name'], qa.get('color2_id'), qa['color2_name']))
+
+        if len(rows['qa_pairs']) >= BATCH_SIZE:
+            _flush(connection, rows)
+
+    _flush(connection, rows)
+
+    logging.info("Creating indexes...")
+    for statement in INDEXES:
+        connection.execute(statement)
+
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+
+
+@click.command()
+@click.argument("split_directory")
+@click.option("-o", "--database-file", default=None,
+                help="SQLite database to write, defaults to figureqa.sqlite in SPLIT_DIRECTORY")
+def main(**kwargs):
+    """
+    Builds a SQLite database of SPLIT_DIRECTORY, produced by 'json_combiner.py', for slicing the data
+    by question, answer, figure type, colors, etc. E.g.
+
+        SELECT image_index FROM images WHERE type = 'pie' AND n_models > 5
+    """
+    logging.basicConfig(level=logging.INFO)
+    build_sqlite_index(**kwargs)
+
+
+if __name__ == "__main__":
+    main()